@@ -0,0 +1,234 @@
+"""Measure how the input loop shares the event loop with playlists loading.
+
+A local http server stands in for the Youtube api and answers every request
+after SERVER_DELAY seconds. The service is built from the real discovery
+document pointed at it, so that NB_PLAYLISTS playlists of PLAYLIST_SIZE videos
+are loaded through YoutubeList.request and the RequestExecutor (rate limiter,
+batches of videos.list, worker pool) while a loop shaped like the main loop
+of youtube_cli waits for keys typed into a pipe. It is run with the previous
+input, get_wch blocking in halfdelay, then with tui.keys.wait_key as the app
+does now: the time to load the playlists and how late the keys are handled
+are reported. No credentials are needed, the requests are anonymous, and the
+pages are stored in a temporary store."""
+
+import asyncio
+import email.parser
+import json
+import sys
+import os
+import select
+import tempfile
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from google.auth.credentials import AnonymousCredentials
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import youtube  # noqa: E402
+from store import MetadataStore  # noqa: E402
+from youtube import MAX_RESULTS  # noqa: E402
+from youtube_api import discovery_document  # noqa: E402
+from tui.keys import wait_key, INPUT_TIMEOUT  # noqa: E402
+
+SERVER_DELAY = 0.2
+NB_PLAYLISTS = 4
+PLAYLIST_SIZE = 200
+KEY_INTERVAL = 0.5  # in seconds, the user is mostly watching
+
+
+def playlist_items(query):
+    playlist = query["playlistId"][0]
+    start = int(query.get("pageToken", ["0"])[0])
+    end = min(start + MAX_RESULTS, PLAYLIST_SIZE)
+    response = {
+        "etag": f"{playlist}-{start}",
+        "items": [
+            {
+                "id": f"item-{playlist}-{i}",
+                "snippet": {"resourceId": {"videoId": f"{playlist}-{i}"}},
+            }
+            for i in range(start, end)
+        ],
+    }
+    if end < PLAYLIST_SIZE:
+        response["nextPageToken"] = str(end)
+    return response
+
+
+def videos(query):
+    return {
+        "items": [
+            {
+                "id": id,
+                "snippet": {"title": id, "description": "", "channelTitle": "bench"},
+                "status": {"privacyStatus": "public"},
+                "contentDetails": {},
+            }
+            for id in query["id"][0].split(",")
+        ]
+    }
+
+
+def answer(path):
+    """The json body answering a GET on [path]"""
+    url = urlsplit(path)
+    query = parse_qs(url.query)
+    if url.path.endswith("/playlistItems"):
+        return json.dumps(playlist_items(query))
+    return json.dumps(videos(query))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the api
+
+    def do_GET(self):
+        time.sleep(SERVER_DELAY)
+        self.reply("application/json", answer(self.path).encode())
+
+    def do_POST(self):
+        """A batch: every part is a GET, answered in a part of the response"""
+        time.sleep(SERVER_DELAY)
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+        batch = email.parser.BytesParser().parsebytes(header + body)
+        boundary = "batch_boundary"
+        parts = []
+        for part in batch.get_payload():
+            request_line = part.get_payload().splitlines()[0]
+            content = answer(request_line.split(" ")[1])
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:]}\r\n\r\n"
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: application/json\r\n\r\n"
+                f"{content}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        self.reply(f"multipart/mixed; boundary={boundary}", "".join(parts).encode())
+
+    def reply(self, content_type, body):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def point_at(url, directory):
+    """Send the requests of the youtube module to the stand-in server"""
+    youtube.store = MetadataStore(os.path.join(directory, "metadata.sqlite"))
+    service = youtube.youtube
+    service.auth.credentials = AnonymousCredentials()
+    service.document = dict(discovery_document(), rootUrl=url)
+
+
+class Keys:
+    """Stand-in for the terminal: a key is typed every KEY_INTERVAL seconds
+    into a pipe, the time it was typed being kept to measure how long it
+    waits before being handled"""
+
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        self.typed = []
+        self.stop = threading.Event()
+        threading.Thread(target=self.type, daemon=True).start()
+
+    def type(self):
+        while not self.stop.wait(KEY_INTERVAL):
+            self.typed.append(time.perf_counter())
+            os.write(self.write_fd, b"k")
+
+    def get_wch(self):
+        """Like get_wch in nodelay mode"""
+        try:
+            return os.read(self.read_fd, 1).decode()
+        except BlockingIOError:
+            return -1
+
+    def close(self):
+        self.stop.set()
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+async def blocking_key(keys):
+    """What the main loop did with halfdelay: get_wch blocks the whole event
+    loop for up to INPUT_TIMEOUT seconds"""
+    select.select([keys.read_fd], [], [], INPUT_TIMEOUT)
+    return keys.get_wch()
+
+
+async def main_loop(keys, wait, stop, latencies):
+    """The shape of the main loop of youtube_cli: wait for a key, handle it,
+    then update the screen (here, the awaits of an update are stood in for)"""
+    handled = 0
+    while not stop.is_set():
+        char = await wait(keys)
+        if char != -1:
+            latencies.append(time.perf_counter() - keys.typed[handled])
+            handled += 1
+        await asyncio.sleep(0)
+
+
+async def run(wait):
+    stop = asyncio.Event()
+    latencies = []
+    keys = Keys()
+    loop = asyncio.create_task(main_loop(keys, wait, stop, latencies))
+    start = time.perf_counter()
+    playlists = [
+        youtube.YoutubePlaylist(f"PL{i}", f"Playlist {i}", PLAYLIST_SIZE)
+        for i in range(NB_PLAYLISTS)
+    ]
+    for p in playlists:
+        p.use_store = False  # the store of the previous run is not read
+    await asyncio.gather(*[p.load_all() for p in playlists])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await loop
+    keys.close()
+    loaded = sum(p.nb_loaded for p in playlists)
+    return elapsed, loaded, latencies
+
+
+async def app_key(keys):
+    return await wait_key(keys.get_wch, fd=keys.read_fd)
+
+
+async def compare():
+    report("blocking", await run(blocking_key))
+    report("app", await run(app_key))
+
+
+def report(name, result):
+    elapsed, loaded, latencies = result
+    latencies = sorted(latencies) or [0]
+    p50 = latencies[len(latencies) // 2] * 1000
+    worst = latencies[-1] * 1000
+    print(
+        f"{name:>10}: {loaded} videos loaded in {elapsed:5.2f}s, "
+        f"{len(result[2]):3d} keys handled after p50 {p50:6.1f}ms, "
+        f"max {worst:6.1f}ms"
+    )
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as directory:
+        point_at(f"http://127.0.0.1:{server.server_address[1]}/", directory)
+        # in one event loop, the locks of the youtube module are bound to it
+        asyncio.run(compare())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
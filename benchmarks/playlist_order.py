@@ -0,0 +1,80 @@
+"""Micro-benchmarks of the play order of a playlist of SIZE entries.
+
+The previous order was a list of ints: finding the position of an element
+was a linear scan, and dropping the indexes of unavailable videos ran max()
+once per index dropped. PlayOrder keeps the inverse permutation alongside."""
+
+import sys
+import os
+import random
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from playlist import PlayOrder  # noqa: E402
+
+SIZE = 100_000
+NB_LOOKUPS = 1_000
+NB_UNAVAILABLE = 500
+
+
+def measure(name, function):
+    start = time.perf_counter()
+    function()
+    print(f"{name:>45}: {(time.perf_counter() - start) * 1000:9.2f}ms")
+
+
+def previous_lookups(order, indexes):
+    for index in indexes:
+        order.index(index)
+
+
+def previous_remove_max(order, size):
+    while order:
+        index_max = max(range(len(order)), key=order.__getitem__)
+        if order[index_max] < size:
+            break
+        order.pop(index_max)
+
+
+def lookups(order, indexes):
+    for index in indexes:
+        order.position(index)
+
+
+def main():
+    rng = random.Random(0)
+    indexes = [rng.randrange(SIZE) for _ in range(NB_LOOKUPS)]
+
+    previous = list(range(SIZE))
+    rng.shuffle(previous)
+    order = PlayOrder(SIZE)
+    order.shuffle()
+
+    measure("shuffle, list", lambda: rng.shuffle(list(range(SIZE))))
+    measure("shuffle, PlayOrder", lambda: PlayOrder(SIZE).shuffle())
+    measure(
+        f"{NB_LOOKUPS} position lookups, list",
+        lambda: previous_lookups(previous, indexes),
+    )
+    measure(
+        f"{NB_LOOKUPS} position lookups, PlayOrder", lambda: lookups(order, indexes)
+    )
+    measure(
+        f"drop {NB_UNAVAILABLE} unavailable, removeMax",
+        lambda: previous_remove_max(previous, SIZE - NB_UNAVAILABLE),
+    )
+    measure(
+        f"drop {NB_UNAVAILABLE} unavailable, PlayOrder",
+        lambda: order.truncate(SIZE - NB_UNAVAILABLE),
+    )
+    assert sorted(order) == sorted(previous) == list(range(SIZE - NB_UNAVAILABLE))
+    print(
+        f"{'memory, list':>45}: {sys.getsizeof(previous) + 28 * SIZE:9d} bytes\n"
+        f"{'memory, PlayOrder':>45}: "
+        f"{sys.getsizeof(order.order) + sys.getsizeof(order.positions):9d} bytes"
+    )
+
+
+if __name__ == "__main__":
+    main()
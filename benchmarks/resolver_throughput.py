@@ -0,0 +1,43 @@
+"""Measure the throughput of the resolver with a stand-in extractor.
+
+The stand-in sleeps EXTRACTION_TIME seconds instead of contacting youtube,
+so the benchmark runs offline and only measures the scheduling overhead."""
+
+import asyncio
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from resolver import Resolver  # noqa: E402
+
+EXTRACTION_TIME = 0.05
+NB_JOBS = 200
+
+
+def stand_in_extractor(video_id):
+    time.sleep(EXTRACTION_TIME)
+    return f"https://video/{video_id}", f"https://audio/{video_id}"
+
+
+async def run(workers):
+    resolver = Resolver(extractor=stand_in_extractor, workers=workers)
+    start = time.perf_counter()
+    jobs = [asyncio.create_task(resolver.submit(str(i))) for i in range(NB_JOBS)]
+    await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{workers:2d} workers: {NB_JOBS / elapsed:7.1f} jobs/s, "
+        f"mean latency {resolver.mean_latency() * 1000:6.1f}ms, "
+        f"max queue depth {resolver.max_queue_depth}"
+    )
+
+
+def main():
+    for workers in (1, 2, 4, 8):
+        asyncio.run(run(workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Measure what building the youtube service costs at startup.
+
+Before, the service was built when youtube.py was imported: a blocking
+connectivity check, then googleapiclient.discovery.build. Now the connection
+is probed in the background, the discovery document is kept in the cache
+directory and the service is only built on the first call to the api.
+No credentials are needed, the service is built unauthenticated."""
+
+import asyncio
+import sys
+import os
+import time
+
+import httplib2
+import googleapiclient.discovery
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from connectivity import ConnectivityMonitor  # noqa: E402
+from youtube_api import Youtube, discovery_document  # noqa: E402
+
+REPEAT = 5
+
+
+def measure(name, function):
+    start = time.perf_counter()
+    try:
+        for _ in range(REPEAT):
+            function()
+    except Exception as e:
+        print(f"{name:>40}: failed ({e})")
+        return
+    elapsed = (time.perf_counter() - start) / REPEAT
+    print(f"{name:>40}: {elapsed * 1000:8.1f}ms")
+
+
+def probe():
+    # blocking here, but run in the background by the application
+    asyncio.run(ConnectivityMonitor().probe())
+
+
+def build_from_network():
+    googleapiclient.discovery.build(
+        "youtube",
+        "v3",
+        http=httplib2.Http(),
+        static_discovery=False,
+        cache_discovery=False,
+    )
+
+
+def build_from_cache():
+    googleapiclient.discovery.build_from_document(
+        discovery_document(), http=httplib2.Http()
+    )
+
+
+def main():
+    discovery_document()  # fills the cache
+    measure("connectivity probe", probe)
+    measure("build, document downloaded", build_from_network)
+    measure("build, document cached", build_from_cache)
+    measure("lazy Youtube()", Youtube)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Measure the memory taken by a synthetic library of NB_VIDEOS videos.
+
+The previous model kept the description of every video in a per-instance
+__dict__. The current one is slotted, interns the authors and only loads
+the description of the videos shown in the information panel."""
+
+import sys
+import os
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from youtube import Video  # noqa: E402
+
+NB_VIDEOS = 50_000
+NB_AUTHORS = 2_000
+DESCRIPTION_LENGTH = 800  # roughly the average of a music video
+item_ids = {}
+
+
+class PreviousVideo:
+    def __init__(self, id="", title="", description="", author="", playlistItemId=""):
+        self.title = title
+        self.author = author
+        self.id = id
+        self.description = description
+        self.playlistItemId = playlistItemId
+        self.skipSegments = []
+        self.skipSegmentsDone = False
+        self.segmentTask = None
+
+
+def rows():
+    """The details of the videos, as they come out of the store or the api:
+    every string is a new object"""
+    rng = random.Random(0)
+    for i in range(NB_VIDEOS):
+        author = f"Channel {rng.randrange(NB_AUTHORS)}"
+        description = "".join(
+            rng.choice("abcdefghij \n") for _ in range(DESCRIPTION_LENGTH)
+        )
+        yield f"{i:011d}", f"Title of the video {i}", description, author, f"item{i}"
+
+
+def measure(name, build):
+    tracemalloc.start()
+    data = list(rows())
+    library = [build(*row) for row in data]
+    del data  # what is not referenced by the library is freed
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>10}: {current / 2**20:7.1f} MiB, "
+        f"{current / len(library):6.0f} bytes per video"
+    )
+
+
+def slotted(id, title, description, author, item_id):
+    # the playlist item ids are now kept by the playlists
+    item_ids[id] = item_id
+    return Video(id, title, author)
+
+
+def main():
+    measure("previous", PreviousVideo)
+    measure("slotted", slotted)
+
+
+if __name__ == "__main__":
+    main()
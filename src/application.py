@@ -6,6 +6,9 @@ import logging
 
 import youtube
 import player
+from lookahead import Lookahead
+from mutations import MutationQueue, ADD, REMOVE
+from resolver import resolver
 
 from widget import Widget, PlaylistPanel
 from tui import screen, textbox, panel
@@ -50,6 +53,13 @@ class InfoPanel(Widget):
         content.append(CurseString(f"Title: {selection.title}"))
         content.append(CurseString(f"Author: {selection.author}"))
         content.append(CurseString(f"Id: {selection.id}"))
+        if isinstance(selection, youtube.Video):
+            description = selection.get_description()
+            if description is None:
+                description = "Loading..."
+            content.append(CurseString("Description:"))
+            for line in description.splitlines():
+                content.append(CurseString(f"  {line}"))
         await super().update(to_display=content)
 
 
@@ -112,6 +122,85 @@ class PlayerPanel(Widget):
         await super().update(to_display=content)
 
 
+class ApiPanel(Widget):
+    """Quota and latency of the api calls, per endpoint and per list"""
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__("API usage", *args, **kwargs)
+        self.selectable = False
+
+    async def update(self, draw_select=False):
+
+        if not self.visible:
+            return
+        usage = youtube.api_usage
+        budget = f" / {usage.quotaBudget}" if usage.quotaBudget else ""
+        content = [CurseString(f"Quota today: {usage.units_today}{budget} units")]
+        pool = youtube.youtube.pool.stats
+        content.append(
+            CurseString(
+                f"Connections: {pool['connections']} opened, {pool['reused']} reused "
+                f"({youtube.youtube.pool.reuse_rate():.0%}), "
+                f"{pool['transports']} transports"
+            )
+        )
+        registry = youtube.video_registry
+        content.append(
+            CurseString(
+                f"Videos: {len(registry)} in memory, "
+                f"{registry.hit_rate():.0%} shared between lists"
+            )
+        )
+        content.append(
+            CurseString(
+                f"Resolver: {resolver.nb_jobs} urls, {resolver.queue_depth()} waiting "
+                f"(at most {resolver.max_queue_depth}), "
+                f"{resolver.mean_latency():.2f}s on average"
+            )
+        )
+        rates = youtube.url_cache.rates()
+        content.append(
+            CurseString(
+                f"Stream urls: {rates['hit']:.0%} cached, {rates['miss']:.0%} missing, "
+                f"{rates['expired']:.0%} expired"
+            )
+        )
+        prefetch = youtube.prefetch_stats
+        misses = prefetch["misses"] / prefetch["renders"] if prefetch["renders"] else 0
+        content.append(
+            CurseString(
+                f"Pages: {youtube.page_stats['downloaded']} downloaded, "
+                f"{youtube.page_stats['revalidated']} revalidated, "
+                f"rows missing on {prefetch['misses']} of {prefetch['renders']} "
+                f"frames ({misses:.0%})"
+            )
+        )
+        stats = youtube.request_executor.stats
+        state = "offline" if youtube.request_executor.offline() else "online"
+        content.append(
+            CurseString(
+                f"Requests: {stats['requests']} ({state}), {stats['retries']} retries, "
+                f"{stats['failures']} failures, {stats['rejected']} rejected, "
+                f"{stats['limiter_wait']:.1f}s waiting for the rate limiter"
+            )
+        )
+        for title, usages in [
+            ("Endpoints", usage.by_endpoint),
+            ("Lists", usage.by_caller),
+        ]:
+            content.append(CurseString(f"{title}:"))
+            for name, u in sorted(usages.items()):
+                content.append(
+                    CurseString(
+                        f"  {name or '?'}: {u.calls} calls, {u.units} units, "
+                        f"{u.bytes // 1024} kB, p50 < {u.percentile(0.5)}s, "
+                        f"p90 < {u.percentile(0.9)}s"
+                    )
+                )
+        await super().update(to_display=content)
+
+
 class Application(PropertyObject):
     """The core of the application"""
 
@@ -128,6 +217,7 @@ class Application(PropertyObject):
         )
         self.local_playlist_panel.set_below_of(self.yt_playlist_panel)
         self.content_panel = Widget("Videos", 0, 0, 80, 88, screen=self.scr)
+        self.content_panel.prefetcher = youtube.Prefetcher()
         self.content_panel.set_right_to(self.yt_playlist_panel)
         self.content_panel.set_right_to(self.local_playlist_panel)
 
@@ -153,6 +243,10 @@ class Application(PropertyObject):
 
         self.search_panel = Widget("Search", 0, 0, 80, 12, screen=self.scr)
         self.in_search = False
+        self.search_task = None
+        self.search_origin = None  # (source, selected, page) before the search
+        self.searchDebounce = None  # in seconds
+        self._add_property("searchDebounce", 0.3)
         self.textbox = textbox.Textbox(0, 0, 80, 12, screen=self.scr)
         self.command_field = textbox.Textbox(0, 0, 80, 3, screen=self.scr)
 
@@ -164,6 +258,11 @@ class Application(PropertyObject):
         self.add_to_playlist_panel.center()
         self.in_add_to_playlist = False
 
+        self.api_panel = ApiPanel(0, 0, 60, 40, screen=self.scr)
+        self.api_panel.toggle_visible()
+        self.api_panel.center()
+        self.membership_task = None
+
         # should the video be played alongside the audio
         self.video_mode = None  # avoid linting errors
         self._add_property(
@@ -178,6 +277,9 @@ class Application(PropertyObject):
         self.in_playlist = None
         self._add_property("in_playlist", False)
         self.playlist = youtube.YoutubeList()
+        self.lookahead = Lookahead()
+        self.mutations = MutationQueue(youtube.store)
+        self.youtube_playlists = None
         self.playlist_index = 0
         self.repeat = None
         self._add_property("repeat", "No", pre_change_hook=self._change_repeat)
@@ -193,15 +295,37 @@ class Application(PropertyObject):
         self.state = PlayerStates.STOPPED
 
     async def init(self):
+        resolver.warm_up()
+        youtube.connectivity.start()
+        youtube.youtube.auth.start()
         folders = FolderList()
         youtubePlaylists = youtube.YoutubePlaylistList()
         await asyncio.gather(folders.init(), youtubePlaylists.init())
         for f in folders.elements:
             self.local_playlist_panel.source.add_playlist(f)
-        for p in youtubePlaylists.elements:
-            self.yt_playlist_panel.source.add_playlist(p)
+        self.youtube_playlists = youtubePlaylists
+        self.show_playlists()
+        self.mutations.start(youtubePlaylists.elements)
+        if youtubePlaylists.revalidate_task is not None:
+            asyncio.create_task(
+                self.show_revalidated(youtubePlaylists.revalidate_task)
+            )
         await self.get_playlist()
 
+    def show_playlists(self):
+        """Show the youtube playlists in the playlist panel"""
+        source = self.yt_playlist_panel.source
+        source.elements = []
+        source.size = 0
+        for p in self.youtube_playlists.elements:
+            source.add_playlist(p)
+        self.mutations.playlists = {p.id: p for p in self.youtube_playlists.elements}
+
+    async def show_revalidated(self, revalidation):
+        """Show the playlists again if the server changed them"""
+        if await revalidation:
+            self.show_playlists()
+
     def _change_volume(self, value):
         if 0 <= value <= 100:
             self.player.set_volume(value)
@@ -210,6 +334,7 @@ class Application(PropertyObject):
 
     def _change_repeat(self, value):
         self.player.set_repeat(value)
+        self.plan_lookahead(value)
 
     def _change_muted(self, value):
         if value:
@@ -218,10 +343,22 @@ class Application(PropertyObject):
             self.player.set_volume(0)
 
     def _change_shuffled(self, value):
-        if value:
-            asyncio.gather(self.playlist.shuffle())
+        asyncio.create_task(self._reorder(value))
+
+    async def _reorder(self, shuffled):
+        if shuffled:
+            await self.playlist.shuffle()
         else:
-            asyncio.gather(self.playlist.unshuffle())
+            await self.playlist.unshuffle()
+        self.plan_lookahead()
+
+    def plan_lookahead(self, repeat=None):
+        """Resolve the next tracks of the playlist while the current one plays"""
+        if not self.in_playlist:
+            self.lookahead.cancel()
+            return
+        repeat = repeat if repeat is not None else self.repeat
+        self.lookahead.replan(self.playlist, repeat, self.video_mode)
 
     def _change_video_mode(self):
         timestamp = self.player.time
@@ -249,21 +386,67 @@ class Application(PropertyObject):
 
     async def search(self):
         self.in_search = True
+        # shown again if the search is abandoned
+        self.search_origin = (
+            self.content_panel.source,
+            self.content_panel.selected,
+            self.content_panel.page,
+        )
         await self.search_panel.update()
         self.textbox.reset()
-        self.textbox.edit(update=self.update)
+        await self.textbox.edit(update=self.update, on_change=self.search_as_you_type)
         search_term = self.textbox.gather()
+        if self.search_task is not None:
+            self.search_task.cancel()
+            self.search_task = None
         if search_term:
             self.search_panel.content = [CurseString(search_term)]
-            self.content_panel.source = youtube.Search(search_term)
+            self.show_results(youtube.Search(search_term))
             self.current_panel = self.content_panel
+        else:
+            self.restore_search_origin()
         self.search_panel.clear()
         self.in_search = False
         await self.update()
 
+    def search_as_you_type(self, query):
+        """Query [query] once the user stopped typing for [searchDebounce] seconds,
+        forgetting the previous query"""
+        if self.search_task is not None:
+            self.search_task.cancel()
+        self.search_task = asyncio.create_task(self._incremental_search(query))
+
+    async def _incremental_search(self, query):
+        await asyncio.sleep(self.searchDebounce)
+        if not query.strip():
+            self.restore_search_origin()
+            return
+        # what is already known is shown while youtube is queried
+        self.show_results(youtube.LibraryMatches(query))
+        if youtube.api_usage.budget_low() and not youtube.search_cache.has(query):
+            return  # the quota is kept for the search the user validates
+        results = youtube.Search(query)
+        # cancelling this task cancels the page being loaded
+        await results.load_task
+        self.show_results(results)
+
+    def restore_search_origin(self):
+        """Show what the content panel showed before the search"""
+        if self.search_origin is None:
+            return
+        source, selected, page = self.search_origin
+        self.content_panel.source = source
+        self.content_panel.selected = selected
+        self.content_panel.page = page
+
+    def show_results(self, source):
+        self.content_panel.source = source
+        self.content_panel.selected = 0
+        self.content_panel.page = 0
+
     async def command(self):
         self.command_field.reset()
-        self.command_field.edit(update=self.update)
+        await self.command_field.edit(update=self.update)
         command = self.command_field.gather()
         if command:
             # TODO
@@ -308,6 +491,7 @@ class Application(PropertyObject):
             await self.search_panel.update()
 
         await self.draw_add_to_playlist()
+        await self.api_panel.update()
 
         self.scr.update()
 
@@ -320,7 +504,10 @@ class Application(PropertyObject):
         content = []
 
         for p in self.yt_playlist_panel.source.elements:
-            if currSelection in p:
+            known = p.known_membership(currSelection.id)
+            if known is None:
+                checkbox = "[?]"  # the server is being asked
+            elif known:
                 checkbox = "[x]"
             else:
                 checkbox = "[ ]"
@@ -358,6 +545,7 @@ class Application(PropertyObject):
             await self.play(await self.playlist.get_current())
         else:
             self.in_playlist = False
+            self.lookahead.cancel()
 
     async def get_playlist(self):
         if isinstance(self.current_panel, PlaylistPanel):
@@ -367,15 +555,29 @@ class Application(PropertyObject):
         self.in_add_to_playlist = True
         self.add_to_playlist_panel.toggle_visible()
         self.current_panel = self.add_to_playlist_panel
+        # asking every playlist at once, the answers are drawn as they come
+        selection = await self.content_panel.get_selected()
+        self.membership_task = asyncio.gather(
+            *[
+                p.has_video(selection.id)
+                for p in self.yt_playlist_panel.source.elements
+            ]
+        )
 
     async def edit_playlist(self):
         currSelection, currPlaylist = await asyncio.gather(
             self.content_panel.get_selected(), self.add_to_playlist_panel.get_selected()
         )
-        if currSelection in currPlaylist:
-            currPlaylist.remove(currSelection)
+        known = currPlaylist.known_membership(currSelection.id)
+        if known is None:
+            # toggling an unknown membership could add the video twice
+            log.warning(f"Not known yet whether {currPlaylist.title} has the video")
+            return
+        # the edit is shown at once and sent to youtube in the background
+        if known:
+            self.mutations.enqueue(currPlaylist, REMOVE, currSelection)
         else:
-            currPlaylist.add(currSelection)
+            self.mutations.enqueue(currPlaylist, ADD, currSelection)
         self.in_add_to_playlist = False
         self.add_to_playlist_panel.toggle_visible()
         self.current_panel = self.content_panel
@@ -399,16 +601,16 @@ class Application(PropertyObject):
 
     async def reload(self):
         await self.content_panel.source.reload()
+        if self.youtube_playlists is not None:
+            revalidation = self.youtube_playlists.revalidate(contents=False)
+            await self.show_revalidated(revalidation)
 
     async def next(self):
         if self.in_playlist:
             if self.playlist.current_index > self.playlist.size:
                 self.player.stop()
             else:
-                (new, next) = await asyncio.gather(
-                    self.playlist.next(), self.playlist.get_next()
-                )
-                await asyncio.gather(next.load_url(), self.play(new))
+                await self.play(await self.playlist.next())
         else:
             await self.content_panel.select(Directions.DOWN)
             await self.play()
@@ -450,6 +652,7 @@ class Application(PropertyObject):
         await self.increase_volume(0)
         self.state = PlayerStates.PLAYING
         self.player.pause(False)
+        self.plan_lookahead()
 
     async def start(self):
         if not self.playing.id:  # nothing is playing
@@ -514,6 +717,11 @@ class Application(PropertyObject):
     def quit(self):
         self.stop()
         self.player.quit()
+        youtube.api_usage.dump()
+
+    async def toggle_api_panel(self):
+        self.api_panel.toggle_visible()
+        youtube.api_usage.dump()
 
     def resize(self):
         self.scr.resize()
@@ -0,0 +1,88 @@
+"""Background monitoring of the connection to the internet"""
+import asyncio
+import logging
+import weakref
+
+from property import PropertyObject
+
+log = logging.getLogger(__name__)
+
+HOST = "one.one.one.one"
+PORT = 80
+TIMEOUT = 2  # in seconds
+OFFLINE_INTERVAL = 5  # in seconds, the connection is probed more often when down
+
+
+class ConnectivityMonitor(PropertyObject):
+    """Probe the connection every [connectivityInterval] seconds in the background
+    and tell the subscribers when it goes down or comes back.
+    The connection is assumed to be up until a probe says otherwise"""
+
+    def __init__(self, host=HOST, port=PORT):
+        super().__init__()
+        self.connectivityInterval = None  # in seconds
+        self._add_property("connectivityInterval", 30)
+        self.host = host
+        self.port = port
+        self.online = True
+        self.subscribers = []  # weak references to the callbacks
+        self.wakeup = None
+        self.task = None
+
+    def subscribe(self, callback):
+        """[callback](online) is called on every change of state. Bound methods are
+        only weakly referenced, so that subscribing does not keep a list alive"""
+        self.subscribers = [ref for ref in self.subscribers if ref() is not None]
+        if hasattr(callback, "__self__"):
+            self.subscribers.append(weakref.WeakMethod(callback))
+        else:
+            self.subscribers.append(lambda: callback)
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    def probe_soon(self):
+        """Probe now rather than at the next interval, e.g. after a failed request"""
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def probe(self):
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
+    async def run(self):
+        while True:
+            self.set_online(await self.probe())
+            interval = self.connectivityInterval if self.online else OFFLINE_INTERVAL
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def set_online(self, online):
+        if online == self.online:
+            return
+        self.online = online
+        log.warning("Connection is back" if online else "No internet connection")
+        alive = []
+        for ref in self.subscribers:
+            callback = ref()
+            if callback is None:
+                continue
+            alive.append(ref)
+            try:
+                callback(online)
+            except Exception as e:
+                log.critical(f"Error in a connectivity subscriber ({e})")
+        self.subscribers = alive
+
+
+connectivity = ConnectivityMonitor()
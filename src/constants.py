@@ -1,7 +1,10 @@
 from enum import Enum, auto
+from appdirs import AppDirs
 
 APP_NAME = "youtube_cli"
 
+dirs = AppDirs(APP_NAME, "sofamaniac")
+
 
 class Event(Enum):
 
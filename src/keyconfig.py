@@ -35,6 +35,7 @@ class KeyConfiguration:
             "s": [app.search],
             "c": [app.reload],
             "v": [app.toggle_video],
+            "u": [app.toggle_api_panel],
             "à": [app.seek_percent, 0],
             "&": [app.seek_percent, 10],
             "é": [app.seek_percent, 20],
@@ -0,0 +1,52 @@
+"""Resolution in the background of the next tracks of the play order"""
+import asyncio
+import logging
+
+from property import PropertyObject
+from resolver import resolver, LOOKAHEAD
+from youtube import Video
+
+log = logging.getLogger(__name__)
+
+
+class Lookahead(PropertyObject):
+    """Keep the urls and the skip segments of the next [lookahead] tracks
+    of the playlist ready, behind the tracks requested by the user"""
+
+    def __init__(self):
+        super().__init__()
+        self.lookahead = None
+        self._add_property("lookahead", 3)
+        self.task = None
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.task = None
+        resolver.cancel_waiting(LOOKAHEAD)
+
+    def replan(self, playlist, repeat, video=False):
+        """Forget the previous plan and resolve the tracks following
+        the current one in the order of [playlist]"""
+        self.cancel()
+        if repeat == "Song" or not playlist.size:
+            return  # the next track is the current one
+        self.task = asyncio.create_task(self._resolve_next(playlist, repeat, video))
+
+    async def _resolve_next(self, playlist, repeat, video):
+        positions = []
+        for i in range(1, self.lookahead + 1):
+            position = playlist.current_index + i
+            if position >= len(playlist.order):
+                if repeat != "Playlist" or not playlist.order:
+                    break
+                position %= len(playlist.order)
+            positions.append(position)
+
+        jobs = []
+        for position in positions:
+            element = await playlist.get_at_index(playlist.order[position])
+            if isinstance(element, Video) and element.id:
+                jobs.append(element.load_url(video, LOOKAHEAD))
+        log.info(f"Looking ahead {len(jobs)} tracks of {playlist.title}")
+        await asyncio.gather(*jobs, return_exceptions=True)
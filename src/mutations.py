@@ -0,0 +1,177 @@
+"""Queue of the playlist edits, applied at once to the interface
+and sent to the api in the background"""
+import asyncio
+import logging
+import random
+
+import googleapiclient.errors
+
+from connectivity import connectivity
+from youtube import video_registry
+
+log = logging.getLogger(__name__)
+
+ADD = "add"
+REMOVE = "remove"
+
+# errors for which sending the edit again would fail the same way
+PERMANENT_ERRORS = [400, 404, 409]
+MAX_BACKOFF = 300  # in seconds
+
+
+class Mutation:
+    def __init__(self, seq, playlist_id, video_id, kind, item_id="", attempts=0):
+        self.seq = seq
+        self.playlist_id = playlist_id
+        self.video_id = video_id
+        self.kind = kind
+        self.item_id = item_id
+        self.attempts = attempts
+
+
+class MutationQueue:
+    """Persistent queue of playlist edits. Edits are applied to the playlists
+    when they are queued, then drained to the api in order. An edit cancels
+    the opposite edit of the same video if that one was not sent yet"""
+
+    def __init__(self, store):
+        self.store = store
+        self.pending = [Mutation(*row) for row in store.get_mutations()]
+        self.playlists = {}  # id -> playlist
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.in_flight = None
+
+    def start(self, playlists):
+        """Start draining the queue, [playlists] being the youtube playlists"""
+        self.playlists = {p.id: p for p in playlists}
+        if self.pending:
+            log.info(f"{len(self.pending)} playlist edits left to send")
+            self.reapply()
+        self.task = asyncio.create_task(self.drain())
+        connectivity.subscribe(self.connectivity_changed)
+
+    def reapply(self):
+        """Apply the edits left from a previous session to the playlists,
+        so that they are shown until they are sent"""
+        videos = self.store.get_videos([m.video_id for m in self.pending])
+        for m in self.pending:
+            playlist = self.playlists.get(m.playlist_id)
+            if playlist is None:
+                continue  # dropped when its turn comes
+            title, author, _ = videos.get(m.video_id, ("", "", True))
+            video = video_registry.get(m.video_id, title, author)
+            if m.kind == ADD:
+                playlist.insert_local(video, m.item_id, verify=False)
+            else:
+                playlist.remove_local(video, verify=False)
+
+    def connectivity_changed(self, online):
+        if online:
+            self.wake()
+
+    def enqueue(self, playlist, kind, video):
+        """Apply the edit to [playlist] and queue it to be sent to the api"""
+        if kind == ADD:
+            playlist.insert_local(video, "", verify=False)
+        else:
+            item_id = playlist.get_item_id(video.id)
+            playlist.remove_local(video, verify=False)
+
+        for m in reversed(self.pending):
+            if m is self.in_flight:
+                break
+            if m.playlist_id == playlist.id and m.video_id == video.id:
+                if m.kind != kind:  # the two edits cancel each other
+                    self.pending.remove(m)
+                    self.store.delete_mutation(m.seq)
+                    if m.kind == REMOVE and m.item_id:
+                        # the video never left the playlist on the server
+                        playlist.set_item_id(video.id, m.item_id)
+                    if not self.edits_of(playlist.id, video.id):
+                        playlist.edit_done(video.id)
+                return
+
+        item_id = item_id if kind == REMOVE else ""
+        seq = self.store.add_mutation(playlist.id, video.id, kind, item_id)
+        self.pending.append(Mutation(seq, playlist.id, video.id, kind, item_id))
+        self.wakeup.set()
+
+    def wake(self):
+        """Retry the pending edits at once, e.g. when the connection is back"""
+        self.wakeup.set()
+
+    async def drain(self):
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            m = self.pending[0]
+            if m.playlist_id not in self.playlists:
+                log.critical(f"Dropping the {m.kind} of {m.video_id}, no playlist")
+                self.done(m, sent=False)
+                continue
+            self.in_flight = m
+            try:
+                await self.send(m)
+            except googleapiclient.errors.HttpError as e:
+                if e.resp.status in PERMANENT_ERRORS:
+                    log.critical(f"Dropping the {m.kind} of {m.video_id} ({e})")
+                    self.done(m, sent=False)
+                else:
+                    await self.backoff(m, e)
+            except Exception as e:
+                await self.backoff(m, e)
+            else:
+                self.done(m)
+            finally:
+                self.in_flight = None
+
+    async def send(self, m):
+        playlist = self.playlists[m.playlist_id]
+        if m.kind == ADD:
+            item_id = await playlist.add_remote(m.video_id)
+            playlist.set_item_id(m.video_id, item_id)
+            # a removal queued while the addition was sent needs its item id
+            for other in self.pending:
+                if (other.playlist_id, other.video_id) == (m.playlist_id, m.video_id):
+                    other.item_id = item_id
+                    self.store.update_mutation(other.seq, item_id, other.attempts)
+        else:
+            await playlist.remove_remote(m.video_id, m.item_id)
+
+    def edits_of(self, playlist_id, video_id):
+        return [
+            m
+            for m in self.pending
+            if (m.playlist_id, m.video_id) == (playlist_id, video_id)
+        ]
+
+    def done(self, m, sent=True):
+        self.pending.remove(m)
+        self.store.delete_mutation(m.seq)
+        playlist = self.playlists.get(m.playlist_id)
+        if playlist is None:
+            return
+        if sent:
+            playlist.pages_shifted()
+        if not self.edits_of(m.playlist_id, m.video_id):
+            playlist.edit_done(m.video_id)
+        others = [o for o in self.pending if o.playlist_id == m.playlist_id]
+        if not others:
+            playlist.verify_in_background()
+
+    async def backoff(self, m, error):
+        m.attempts += 1
+        self.store.update_mutation(m.seq, m.item_id, m.attempts)
+        delay = min(2**m.attempts, MAX_BACKOFF) * random.uniform(0.5, 1)
+        log.warning(
+            f"Could not send the {m.kind} of {m.video_id} ({error}), "
+            f"retrying in {delay:.0f}s"
+        )
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
@@ -1,7 +1,10 @@
-from random import shuffle
+from array import array
+from random import randint, randrange
 
 
 class Playable:
+    __slots__ = ("title", "author", "id", "__weakref__")
+
     def __init__(self, title="", author="", id=None):
         self.title = title
         self.author = author
@@ -31,6 +34,117 @@ class Playable:
         return False
 
 
+class PlayOrder:
+    """Permutation of the indexes of a playlist: [order][position] is the index
+    of the element played at [position], and [positions][index] is the position
+    of the element at [index]. Both are arrays of ints, so that looking up the
+    position of an element is O(1).
+    A [lazy] order is shuffled as it is read: the first [drawn] positions are
+    fixed, and the element played next is drawn among the others (incremental
+    Fisher-Yates), to which the elements join as they are loaded"""
+
+    def __init__(self, size=0, lazy=False):
+        self.order = array("l", range(size))
+        self.positions = array("l", range(size))
+        self.lazy = lazy
+        self.drawn = 0 if lazy else size
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, position):
+        if self.drawn <= position < len(self.order):
+            self.draw(position)
+        return self.order[position]
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def position(self, index):
+        """Returns the position of [index], or None if it is not in the order"""
+        if 0 <= index < len(self.positions) and self.positions[index] >= 0:
+            return self.positions[index]
+        return None
+
+    def fix(self, index):
+        """Returns the position of [index], making it the next drawn one
+        if it was not drawn yet"""
+        position = self.position(index)
+        if position is not None and position >= self.drawn:
+            self.swap(position, self.drawn)
+            position = self.drawn
+            self.drawn += 1
+        return position
+
+    def swap(self, p, q):
+        i, j = self.order[p], self.order[q]
+        self.order[p], self.order[q] = j, i
+        self.positions[i], self.positions[j] = q, p
+
+    def shuffle(self, start=0):
+        """Shuffle the positions from [start] on (Fisher-Yates)"""
+        for p in range(len(self.order) - 1, start, -1):
+            self.swap(p, randrange(start, p + 1))
+        self.drawn = len(self.order)
+
+    def draw(self, position):
+        """Fix the positions up to [position] by drawing among the undrawn ones"""
+        while self.drawn <= position:
+            self.swap(self.drawn, randrange(self.drawn, len(self.order)))
+            self.drawn += 1
+
+    def extend(self, size):
+        """Add the indexes up to [size] at the end of the order,
+        with the undrawn ones if the order is lazy"""
+        for index in range(len(self.positions), size):
+            self.positions.append(len(self.order))
+            self.order.append(index)
+        if not self.lazy:
+            self.drawn = len(self.order)
+
+    def truncate(self, size):
+        """Remove the indexes greater than [size] in one pass, keeping
+        the relative order of the others"""
+        if len(self.positions) <= size:
+            return
+        order = array("l")
+        drawn = 0
+        for position, index in enumerate(self.order):
+            if index < size:
+                order.append(index)
+                if position < self.drawn:
+                    drawn += 1
+        self.order = order
+        self.drawn = drawn if self.lazy else len(order)
+        self.positions = array("l", [-1]) * size
+        for position, index in enumerate(self.order):
+            self.positions[index] = position
+
+    def rebuild_positions(self):
+        self.positions = array("l", [-1]) * (max(self.order, default=-1) + 1)
+        for position, index in enumerate(self.order):
+            self.positions[index] = position
+
+    def insert(self, position, index):
+        """Insert [index] at [position], shifting the indexes from [index] on"""
+        self.order = array("l", (i + 1 if i >= index else i for i in self.order))
+        self.order.insert(position, index)
+        if position < self.drawn or not self.lazy:
+            self.drawn += 1
+        self.rebuild_positions()
+
+    def remove(self, index):
+        """Remove [index], shifting the indexes greater than [index]"""
+        position = self.position(index)
+        if position is not None:
+            self.order.pop(position)
+            if position < self.drawn:
+                self.drawn -= 1
+        self.order = array("l", (i - 1 if i > index else i for i in self.order))
+        self.rebuild_positions()
+        return position
+
+
 class Playlist:
     def __init__(self):
         self.current_index = 0
@@ -39,7 +153,7 @@ class Playlist:
 
         self.elements = []
         self.size = 0
-        self.order = []
+        self.order = PlayOrder()
         self.title = ""
         self.shuffled = False
 
@@ -70,18 +184,55 @@ class Playlist:
         return await self.get_at_index(index).getUrl()
 
     async def shuffle(self):
-        self.order = list(range(self.size))
-        shuffle(self.order)
+        self.order = PlayOrder(self.size)
+        self.order.shuffle()
         self.shuffled = True
 
     async def unshuffle(self):
-        self.order = list(range(self.size))
+        self.order = PlayOrder(self.size)
         self.shuffled = False
 
+    def order_insert(self, index: int):
+        """Patch the order after an element was inserted at [index]"""
+        if self.shuffled:
+            start = min(self.current_index + 1, len(self.order))
+            position = randint(start, len(self.order))
+        else:
+            position = min(index, len(self.order))
+        self.order.insert(position, index)
+        if position <= self.current_index < len(self.order) - 1:
+            self.current_index += 1
+
+    def order_remove(self, index: int):
+        """Patch the order after the element at [index] was removed"""
+        position = self.order.remove(index)
+        if position is not None and position < self.current_index:
+            self.current_index -= 1
+
+    def order_truncate(self, size: int):
+        """Remove from the order the indexes greater than [size],
+        keeping the position of the current element"""
+        if len(self.order) <= size:
+            return
+        current = None
+        if self.current_index < len(self.order):
+            current = self.order[self.current_index]
+        self.order.truncate(size)
+        if current is not None and current < size:
+            self.current_index = self.order.position(current)
+
+    async def fill_order(self, position: int):
+        """Make sure the order reaches [position], if the playlist has
+        enough elements"""
+        return
+
     async def next(self) -> Playable:
         if self.current_index >= self.size:
             return Playable()
         self.current_index += 1
+        await self.fill_order(self.current_index)
+        if self.current_index >= len(self.order):
+            return Playable()
         shuffled_index = self.order[self.current_index]
         return await self.get_at_index(shuffled_index)
 
@@ -93,11 +244,17 @@ class Playlist:
         return await self.get_at_index(shuffled_index)
 
     async def get_current(self) -> Playable:
+        await self.fill_order(self.current_index)
+        if self.current_index >= len(self.order):
+            return Playable()
         shuffled_index = self.order[self.current_index]
         return await self.get_at_index(shuffled_index)
 
     async def get_next(self) -> Playable:
-        index = (self.current_index + 1) % self.size
+        await self.fill_order(self.current_index + 1)
+        if not self.order:
+            return Playable()
+        index = (self.current_index + 1) % len(self.order)
         shuffled_index = self.order[index]
         return await self.get_at_index(shuffled_index)
 
@@ -110,11 +267,8 @@ class Playlist:
         return self.size - 1
 
     async def set_effective_index(self, index):
-        self.current_index = 0
-        while (
-            self.current_index < self.size and self.order[self.current_index] != index
-        ):
-            self.current_index += 1
+        position = self.order.fix(index)
+        self.current_index = self.size if position is None else position
 
     async def search(self, query: str) -> int:
         """Search for [query] in the title of the playlist element.
@@ -0,0 +1,174 @@
+"""Resolution of the stream urls of a video through the yt-dlp python api"""
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import yt_dlp
+
+log = logging.getLogger(__name__)
+
+YDL_OPTIONS = {
+    "quiet": True,
+    "no_warnings": True,
+    "noplaylist": True,
+    "skip_download": True,
+}
+
+MAX_WORKERS = 2
+# YoutubeDL objects are not meant to be shared between threads, each worker
+# keeps its own for the whole session, along with its player and http caches
+_local = threading.local()
+
+
+def get_ydl():
+    if not hasattr(_local, "ydl"):
+        _local.ydl = yt_dlp.YoutubeDL(YDL_OPTIONS)
+    return _local.ydl
+
+
+def select_urls(info):
+    """Returns the (video_url, audio_url) of the formats that yt-dlp would select
+    with "best" and "bestaudio/best".
+    yt-dlp sorts the formats from worst to best"""
+    formats = [f for f in info.get("formats", []) if f.get("url")]
+    video_url = info.get("url", "")
+    audio_url = ""
+    for f in formats:
+        has_audio = f.get("acodec") != "none"
+        has_video = f.get("vcodec") != "none"
+        if has_audio and has_video:
+            video_url = f["url"]
+        elif has_audio:
+            audio_url = f["url"]
+    return video_url, audio_url or video_url
+
+
+def extract(video_id):
+    """Extract the format manifest of [video_id] once and derive both urls from it"""
+    try:
+        info = get_ydl().extract_info(f"https://youtu.be/{video_id}", download=False)
+    except yt_dlp.utils.DownloadError as e:
+        log.warning(f"yt-dlp could not extract {video_id} ({e})")
+        return "", ""
+    return select_urls(info)
+
+
+# priorities of the jobs, the lowest value is served first
+USER = 0
+LOOKAHEAD = 1
+
+
+class Resolver:
+    """Long-lived pool of extraction workers.
+    [extractor] is called in a worker thread with a video id and returns
+    (video_url, audio_url), it can be replaced to benchmark the resolver offline"""
+
+    def __init__(self, extractor=extract, workers=MAX_WORKERS):
+        self.extractor = extractor
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="resolver"
+        )
+        self.active = 0  # number of busy workers
+        # heap of [priority, sequence number, future, video id] waiting for a worker
+        self.queue = []
+        self.sequence = itertools.count()
+        self.entries = {}  # video id -> its entry in the queue
+        self.running = {}  # video id -> task, so a video is extracted once at a time
+        self.nb_jobs = 0
+        self.max_queue_depth = 0  # since the creation of the resolver
+        # in seconds, waiting time included, of the last jobs
+        self.latencies = deque(maxlen=100)
+
+    def warm_up(self):
+        """Create the YoutubeDL of every worker before the first extraction"""
+        if self.extractor is extract:
+            for _ in range(self.workers):
+                self.executor.submit(get_ydl)
+
+    async def submit(self, video_id, priority=USER):
+        """Returns the (video_url, audio_url) of [video_id] without blocking the loop"""
+        if video_id not in self.running:
+            task = asyncio.create_task(self._run(video_id, priority))
+            task.add_done_callback(lambda _: self.running.pop(video_id, None))
+            self.running[video_id] = task
+        elif video_id in self.entries and priority < self.entries[video_id][0]:
+            self._requeue(video_id, priority)
+        # the extraction goes on if the caller is cancelled, others may wait for it
+        return await asyncio.shield(self.running[video_id])
+
+    def cancel_waiting(self, priority):
+        """Cancel the jobs of [priority] that have not started yet"""
+        for video_id, entry in list(self.entries.items()):
+            if entry[0] == priority and video_id in self.running:
+                self.running[video_id].cancel()
+
+    def _requeue(self, video_id, priority):
+        old = self.entries[video_id]
+        old[3] = None  # the old entry is skipped when popped
+        entry = [priority, next(self.sequence), old[2], video_id]
+        self.entries[video_id] = entry
+        heapq.heappush(self.queue, entry)
+
+    async def _acquire(self, video_id, priority):
+        if self.active < self.workers and not self.queue:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self.sequence), future, video_id]
+        self.entries[video_id] = entry
+        heapq.heappush(self.queue, entry)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth())
+        try:
+            await future  # the worker is handed over by _release
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        finally:
+            self.entries.pop(video_id, None)
+
+    def _release(self):
+        while self.queue:
+            _, _, future, video_id = heapq.heappop(self.queue)
+            if video_id is not None and not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    async def _run(self, video_id, priority):
+        start = time.perf_counter()
+        await self._acquire(video_id, priority)
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                self.executor, self.extractor, video_id
+            )
+        finally:
+            self._release()
+        self.latencies.append(time.perf_counter() - start)
+        self.nb_jobs += 1
+        log.info(f"Resolved {video_id} in {self.latencies[-1]:.2f}s")
+        return result
+
+    def queue_depth(self):
+        """Number of jobs waiting for a free worker"""
+        return len(self.entries)
+
+    def mean_latency(self):
+        if not self.latencies:
+            return 0
+        return sum(self.latencies) / len(self.latencies)
+
+
+resolver = Resolver()
+
+
+async def resolve(video_id, priority=USER):
+    """Returns the (video_url, audio_url) of [video_id] without blocking the loop"""
+    return await resolver.submit(video_id, priority)
@@ -0,0 +1,70 @@
+"""Cache of the search results, bounded in size and in age"""
+from collections import OrderedDict
+from time import time
+import logging
+
+from property import PropertyObject
+
+log = logging.getLogger(__name__)
+
+
+def normalize(query):
+    return " ".join(query.lower().split())
+
+
+class SearchCache(PropertyObject):
+    """Pages of search results keyed by normalized query and page token.
+    At most [searchCacheSize] pages are kept, the least recently used being
+    dropped first, and pages older than [searchCacheTtl] seconds are ignored"""
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self.searchCacheSize = None
+        self._add_property("searchCacheSize", 200)
+        self.searchCacheTtl = None
+        self._add_property("searchCacheTtl", 24 * 3600)
+        self.stats = {"hit": 0, "miss": 0}
+        # (query, page token) -> (fetched_at, response), most recently used last
+        self.entries = OrderedDict()
+        for query, page_token, fetched_at, response in store.get_searches():
+            self.entries[(query, page_token)] = (fetched_at, response)
+        self._evict()
+
+    def get(self, query, page_token):
+        """Returns the response cached for [query] at [page_token], or None"""
+        key = (normalize(query), page_token or "")
+        if key not in self.entries:
+            self.stats["miss"] += 1
+            return None
+        fetched_at, response = self.entries[key]
+        if fetched_at + self.searchCacheTtl < time():
+            self.stats["miss"] += 1
+            del self.entries[key]
+            self.store.delete_search(*key)
+            return None
+        self.stats["hit"] += 1
+        self.entries.move_to_end(key)
+        self.store.touch_search(*key, time())
+        return response
+
+    def has(self, query, page_token=None):
+        """Whether a fresh page is cached, without counting a hit or a miss"""
+        key = (normalize(query), page_token or "")
+        return (
+            key in self.entries
+            and self.entries[key][0] + self.searchCacheTtl >= time()
+        )
+
+    def put(self, query, page_token, response):
+        key = (normalize(query), page_token or "")
+        now = time()
+        self.entries[key] = (now, response)
+        self.entries.move_to_end(key)
+        self.store.set_search(*key, now, response)
+        self._evict()
+
+    def _evict(self):
+        while len(self.entries) > self.searchCacheSize:
+            key, _ = self.entries.popitem(last=False)
+            self.store.delete_search(*key)
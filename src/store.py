@@ -0,0 +1,330 @@
+"""Persistent metadata store for playlists and videos"""
+import os
+import json
+import sqlite3
+import logging
+
+from constants import dirs
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS playlists (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    item_count INTEGER NOT NULL,
+    liked INTEGER NOT NULL DEFAULT 0,
+    position INTEGER NOT NULL,
+    complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS playlist_items (
+    playlist_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    video_id TEXT NOT NULL,
+    playlist_item_id TEXT NOT NULL,
+    PRIMARY KEY (playlist_id, position)
+);
+CREATE TABLE IF NOT EXISTS videos (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    author TEXT NOT NULL,
+    available INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    etag TEXT NOT NULL,
+    response TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mutations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    playlist_id TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    playlist_item_id TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS searches (
+    query TEXT NOT NULL,
+    page_token TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    response TEXT NOT NULL,
+    PRIMARY KEY (query, page_token)
+);
+CREATE TABLE IF NOT EXISTS stream_urls (
+    video_id TEXT NOT NULL,
+    format TEXT NOT NULL,
+    url TEXT NOT NULL,
+    expire INTEGER NOT NULL,
+    PRIMARY KEY (video_id, format)
+);
+"""
+
+
+class MetadataStore:
+    """On-disk copy of the playlists, playlist items and video snippets,
+    keyed by their youtube id"""
+
+    def __init__(self, path=None):
+        if path is None:
+            os.makedirs(dirs.user_data_dir, exist_ok=True)
+            path = os.path.join(dirs.user_data_dir, "metadata.sqlite")
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def get_playlists(self):
+        """Returns the list of (id, title, item_count, liked) in display order"""
+        return self.db.execute(
+            "SELECT id, title, item_count, liked FROM playlists ORDER BY position"
+        ).fetchall()
+
+    def set_playlists(self, playlists):
+        """Replace the stored list of playlists by [playlists],
+        a list of (id, title, item_count, liked)"""
+        with self.db:
+            ids = [p[0] for p in playlists]
+            self.db.execute(
+                f"DELETE FROM playlists WHERE id NOT IN ({','.join('?' * len(ids))})",
+                ids,
+            )
+            for position, (id, title, item_count, liked) in enumerate(playlists):
+                self.db.execute(
+                    """INSERT INTO playlists (id, title, item_count, liked, position)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET title=excluded.title,
+                    item_count=excluded.item_count, liked=excluded.liked,
+                    position=excluded.position""",
+                    (id, title, item_count, int(liked), position),
+                )
+
+    def get_playlist_items(self, playlist_id):
+        """Returns the list of (video_id, playlist_item_id) of the playlist,
+        or None if the playlist was never entirely stored"""
+        row = self.db.execute(
+            "SELECT complete FROM playlists WHERE id = ?", (playlist_id,)
+        ).fetchone()
+        if not row or not row[0]:
+            return None
+        return self.db.execute(
+            """SELECT video_id, playlist_item_id FROM playlist_items
+            WHERE playlist_id = ? ORDER BY position""",
+            (playlist_id,),
+        ).fetchall()
+
+    def add_playlist_items(self, playlist_id, position, items):
+        """Store [items] starting at [position] in the playlist.
+        Storing the first page (position 0) discards the previous content"""
+        with self.db:
+            if position == 0:
+                self.db.execute(
+                    "DELETE FROM playlist_items WHERE playlist_id = ?", (playlist_id,)
+                )
+                self.db.execute(
+                    "UPDATE playlists SET complete = 0 WHERE id = ?", (playlist_id,)
+                )
+            self.db.executemany(
+                """INSERT OR REPLACE INTO playlist_items
+                (playlist_id, position, video_id, playlist_item_id)
+                VALUES (?, ?, ?, ?)""",
+                [
+                    (playlist_id, position + i, video_id, item_id)
+                    for i, (video_id, item_id) in enumerate(items)
+                ],
+            )
+
+    def insert_playlist_item(self, playlist_id, position, video_id, item_id):
+        """Insert an item at [position], shifting the following ones"""
+        with self.db:
+            # moving the items out of the way in two steps
+            # as the positions are part of the primary key
+            self.db.execute(
+                """UPDATE playlist_items SET position = -position - 1
+                WHERE playlist_id = ? AND position >= ?""",
+                (playlist_id, position),
+            )
+            self.db.execute(
+                """UPDATE playlist_items SET position = -position
+                WHERE playlist_id = ? AND position < 0""",
+                (playlist_id,),
+            )
+            self.db.execute(
+                """INSERT INTO playlist_items
+                (playlist_id, position, video_id, playlist_item_id)
+                VALUES (?, ?, ?, ?)""",
+                (playlist_id, position, video_id, item_id),
+            )
+
+    def remove_playlist_item(self, playlist_id, video_id):
+        """Remove the first item of [video_id], shifting the following ones"""
+        row = self.db.execute(
+            """SELECT position FROM playlist_items WHERE playlist_id = ?
+            AND video_id = ? ORDER BY position LIMIT 1""",
+            (playlist_id, video_id),
+        ).fetchone()
+        if not row:
+            return
+        with self.db:
+            self.db.execute(
+                "DELETE FROM playlist_items WHERE playlist_id = ? AND position = ?",
+                (playlist_id, row[0]),
+            )
+            self.db.execute(
+                """UPDATE playlist_items SET position = -position + 1
+                WHERE playlist_id = ? AND position > ?""",
+                (playlist_id, row[0]),
+            )
+            self.db.execute(
+                """UPDATE playlist_items SET position = -position
+                WHERE playlist_id = ? AND position < 0""",
+                (playlist_id,),
+            )
+
+    def set_playlist_item_id(self, playlist_id, video_id, item_id):
+        with self.db:
+            self.db.execute(
+                """UPDATE playlist_items SET playlist_item_id = ?
+                WHERE playlist_id = ? AND video_id = ? AND playlist_item_id = ''""",
+                (item_id, playlist_id, video_id),
+            )
+
+    def set_complete(self, playlist_id, complete=True):
+        with self.db:
+            self.db.execute(
+                "UPDATE playlists SET complete = ? WHERE id = ?",
+                (int(complete), playlist_id),
+            )
+
+    def get_videos(self, ids):
+        """Returns a dict id -> (title, author, available)
+        of the videos of [ids] that are stored"""
+        result = {}
+        # sqlite limits the number of parameters of a query
+        for i in range(0, len(ids), 500):
+            chunk = ids[i : i + 500]
+            rows = self.db.execute(
+                f"""SELECT id, title, author, available FROM videos
+                WHERE id IN ({','.join('?' * len(chunk))})""",
+                chunk,
+            )
+            for id, title, author, available in rows:
+                result[id] = (title, author, bool(available))
+        return result
+
+    def get_description(self, id):
+        """Returns the description of the video [id], or None if not stored"""
+        row = self.db.execute(
+            "SELECT description FROM videos WHERE id = ?", (id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def add_videos(self, videos):
+        """Store [videos], a list of (id, title, description, author, available)"""
+        with self.db:
+            self.db.executemany(
+                """INSERT OR REPLACE INTO videos
+                (id, title, description, author, available)
+                VALUES (?, ?, ?, ?, ?)""",
+                [(*v[:4], int(v[4])) for v in videos],
+            )
+
+    def get_page(self, key):
+        """Returns the (etag, response) of the api response stored under [key],
+        or None"""
+        row = self.db.execute(
+            "SELECT etag, response FROM pages WHERE key = ?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        return row[0], json.loads(row[1])
+
+    def set_page(self, key, etag, response):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO pages (key, etag, response) VALUES (?, ?, ?)",
+                (key, etag, json.dumps(response)),
+            )
+
+    def get_stream_url(self, video_id, format):
+        """Returns the (url, expire) stored for [video_id] in [format], or None"""
+        return self.db.execute(
+            "SELECT url, expire FROM stream_urls WHERE video_id = ? AND format = ?",
+            (video_id, format),
+        ).fetchone()
+
+    def set_stream_url(self, video_id, format, url, expire):
+        with self.db:
+            self.db.execute(
+                """INSERT OR REPLACE INTO stream_urls (video_id, format, url, expire)
+                VALUES (?, ?, ?, ?)""",
+                (video_id, format, url, expire),
+            )
+
+    def delete_stream_urls(self, before):
+        """Delete the stream urls expiring before the timestamp [before]"""
+        with self.db:
+            self.db.execute("DELETE FROM stream_urls WHERE expire < ?", (before,))
+
+    def get_mutations(self):
+        """Returns the pending playlist edits as
+        (seq, playlist_id, video_id, kind, playlist_item_id, attempts) in order"""
+        return self.db.execute(
+            """SELECT seq, playlist_id, video_id, kind, playlist_item_id, attempts
+            FROM mutations ORDER BY seq"""
+        ).fetchall()
+
+    def add_mutation(self, playlist_id, video_id, kind, item_id):
+        """Returns the sequence number of the new edit"""
+        with self.db:
+            cursor = self.db.execute(
+                """INSERT INTO mutations (playlist_id, video_id, kind, playlist_item_id)
+                VALUES (?, ?, ?, ?)""",
+                (playlist_id, video_id, kind, item_id),
+            )
+        return cursor.lastrowid
+
+    def update_mutation(self, seq, item_id, attempts):
+        with self.db:
+            self.db.execute(
+                "UPDATE mutations SET playlist_item_id = ?, attempts = ? WHERE seq = ?",
+                (item_id, attempts, seq),
+            )
+
+    def delete_mutation(self, seq):
+        with self.db:
+            self.db.execute("DELETE FROM mutations WHERE seq = ?", (seq,))
+
+    def get_searches(self):
+        """Returns the stored search pages as
+        (query, page_token, fetched_at, response), least recently used first"""
+        rows = self.db.execute(
+            """SELECT query, page_token, fetched_at, response FROM searches
+            ORDER BY accessed_at"""
+        ).fetchall()
+        return [(q, t, f, json.loads(r)) for q, t, f, r in rows]
+
+    def set_search(self, query, page_token, fetched_at, response):
+        with self.db:
+            self.db.execute(
+                """INSERT OR REPLACE INTO searches
+                (query, page_token, fetched_at, accessed_at, response)
+                VALUES (?, ?, ?, ?, ?)""",
+                (query, page_token, fetched_at, fetched_at, json.dumps(response)),
+            )
+
+    def touch_search(self, query, page_token, accessed_at):
+        with self.db:
+            self.db.execute(
+                """UPDATE searches SET accessed_at = ?
+                WHERE query = ? AND page_token = ?""",
+                (accessed_at, query, page_token),
+            )
+
+    def delete_search(self, query, page_token):
+        with self.db:
+            self.db.execute(
+                "DELETE FROM searches WHERE query = ? AND page_token = ?",
+                (query, page_token),
+            )
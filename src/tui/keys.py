@@ -0,0 +1,32 @@
+"""Waiting for the keys of the user without blocking the event loop"""
+import asyncio
+import sys
+
+# in seconds, the screen is drawn again at least this often without keys
+INPUT_TIMEOUT = 0.2
+
+
+async def wait_readable(fd, timeout):
+    """Wait until [fd] has something to read, or for at most [timeout] seconds,
+    while the other tasks run"""
+    loop = asyncio.get_running_loop()
+    readable = asyncio.Event()
+    loop.add_reader(fd, readable.set)
+    try:
+        await asyncio.wait_for(readable.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        loop.remove_reader(fd)
+
+
+async def wait_key(get_wch, timeout=INPUT_TIMEOUT, fd=None):
+    """Returns the next key, or -1 if none came within [timeout] seconds.
+    [get_wch] must not block (nodelay) and return -1 without a key: the keys
+    already read by curses are returned at once, otherwise stdin is waited
+    for with the event loop"""
+    char = get_wch()
+    if char != -1:
+        return char
+    await wait_readable(sys.stdin.fileno() if fd is None else fd, timeout)
+    return get_wch()
@@ -4,6 +4,8 @@ import locale
 import wcwidth
 import _curses
 
+from tui.keys import wait_key
+
 
 class Directions(Enum):
     UP = 0
@@ -94,12 +96,13 @@ class Screen:
         locale.setlocale(locale.LC_ALL, "")
         locale.setlocale(locale.LC_NUMERIC, "C")
 
-        curses.halfdelay(2)
         curses.set_escdelay(20)
         curses.curs_set(0)
         curses.use_default_colors()
 
         self.stdscr = stdscr
+        # the keys are waited for with the event loop, see [wait_key]
+        self.stdscr.nodelay(True)
 
         self.wins = []
 
@@ -119,6 +122,11 @@ class Screen:
         except _curses.error:
             return -1
 
+    async def wait_key(self):
+        """Returns the next key, or -1 if none was typed for [INPUT_TIMEOUT]
+        seconds, without blocking the event loop"""
+        return await wait_key(self.get_wch)
+
     @property
     def max_x(self):
         return curses.COLS
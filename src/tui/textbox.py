@@ -3,6 +3,10 @@ import curses
 import curses.ascii
 import _curses
 from tui import panel
+from tui.keys import wait_key
+
+# in seconds, how often the screen is updated while waiting for keys
+UPDATE_INTERVAL = 0.05
 
 
 class Textbox(panel.Panel):
@@ -16,20 +20,32 @@ class Textbox(panel.Panel):
         self.content = ["\0"]
         self.editingpos = 0  # position of the letter right in front of the cursor
 
-    def edit(self, update=None):
-        """the update parameter is an optional function to be called to update the screen while
-        the process is occupied by the search box"""
+    async def edit(self, update=None, on_change=None):
+        """the update parameter is an optional coroutine function to be called to update
+        the screen while the process is occupied by the search box.
+        on_change is called with the content of the box each time it is modified"""
         self.win.refresh()
+        self.win.nodelay(True)  # the keys are waited for with the event loop
+        try:
+            await self._edit(update, on_change)
+        finally:
+            self.win.nodelay(False)
+
+    def get_wch(self):
+        try:
+            return self.win.get_wch()
+        except _curses.error:
+            return -1
+
+    async def _edit(self, update, on_change):
         size = self.win.getmaxyx()[1] - 2
         while True:
-            try:
-                char = self.win.get_wch()
-            except _curses.error:
-                continue
+            char = await wait_key(self.get_wch, UPDATE_INTERVAL)
 
+            previous = self.gather()
             if isinstance(char, int):
                 if char == -1:
-                    continue
+                    pass  # no key, the screen is only updated
                 elif char == curses.ascii.ESC:
                     self.reset()
                     return
@@ -56,8 +72,11 @@ class Textbox(panel.Panel):
                 self.editingpos += 1
                 self.content.insert(self.editingpos, char)
 
+            if on_change and self.gather() != previous:
+                on_change(self.gather())
+
             if update:
-                update()
+                await update()
 
             self.win.erase()
 
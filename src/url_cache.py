@@ -0,0 +1,58 @@
+"""Cache of the stream urls resolved by yt-dlp, shared across sessions"""
+from urllib.parse import urlparse
+from urllib.parse import parse_qs
+from time import time
+import logging
+
+from property import PropertyObject
+
+log = logging.getLogger(__name__)
+
+
+def get_expire(url):
+    """Returns the timestamp of the expire parameter of a googlevideo url,
+    or None if there is none"""
+    try:
+        return int(parse_qs(urlparse(url).query)["expire"][0])
+    except (KeyError, ValueError, IndexError):
+        return None
+
+
+class UrlCache(PropertyObject):
+    """Stream urls keyed by video id and format. Entries are dropped
+    [urlSafetyMargin] seconds before the url expires"""
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self.urlSafetyMargin = None
+        self._add_property("urlSafetyMargin", 600)
+        self.stats = {"hit": 0, "miss": 0, "expired": 0}
+        self.store.delete_stream_urls(time() + self.urlSafetyMargin)
+
+    def get(self, video_id, format):
+        """Returns the cached url or "" if there is no valid url"""
+        entry = self.store.get_stream_url(video_id, format)
+        if entry is None:
+            self.stats["miss"] += 1
+            return ""
+        url, expire = entry
+        if expire < time() + self.urlSafetyMargin:
+            self.stats["expired"] += 1
+            self.store.delete_stream_urls(time() + self.urlSafetyMargin)
+            return ""
+        self.stats["hit"] += 1
+        return url
+
+    def put(self, video_id, format, url):
+        expire = get_expire(url)
+        if not url or expire is None:
+            return  # we cannot know when the url will stop working
+        self.store.set_stream_url(video_id, format, url, expire)
+
+    def rates(self):
+        """Returns the proportion of hit, miss and expired lookups"""
+        total = sum(self.stats.values())
+        if not total:
+            return {k: 0 for k in self.stats}
+        return {k: v / total for k, v in self.stats.items()}
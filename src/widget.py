@@ -19,6 +19,7 @@ class Widget(panel.Panel):
         self.page = 0
         self.visible = True
         self.selectable = True
+        self.prefetcher = None
 
     async def update(self, draw_select=True, to_display=[]):
         if not self.visible:
@@ -33,6 +34,9 @@ class Widget(panel.Panel):
 
         self.title.draw_to_win(self.win, 0, 1, width)
 
+        if self.prefetcher:
+            self.prefetcher.watch(self.source, off + page_size)
+
         if not to_display and self.source:
             to_display = await self.get_content(off, page_size + off)
 
@@ -1,87 +1,128 @@
 # -*- coding: utf-8 -*-
+import sys
 import logging
 import asyncio
+import bisect
+import weakref
 
-from urllib.parse import urlparse
-from urllib.parse import parse_qs
-from time import time
-from threading import Lock
-import google.auth.exceptions
 import googleapiclient.errors
 
-from playlist import Playlist, Playable
+from playlist import Playlist, Playable, PlayOrder
+from property import PropertyObject
 from sponsorblockWrapper import SponsorBlock
+from store import MetadataStore
+from url_cache import UrlCache
+from search_cache import SearchCache
+from connectivity import connectivity
+from resolver import resolve, USER
 from youtube_api import *
 
 log = logging.getLogger(__name__)
 
 youtube = Youtube()
+store = MetadataStore()
+url_cache = UrlCache(store)
+search_cache = SearchCache(store)
+batcher = BatchRequester(youtube)
+request_executor = RequestExecutor(youtube, batcher)
 MAX_RESULTS = 50
 sponsorBlock = SponsorBlock()
+# number of pages answered with 304 Not Modified vs downloaded again
+page_stats = {"revalidated": 0, "downloaded": 0}
+# number of frames drawn and of frames where rows were not loaded yet
+prefetch_stats = {"renders": 0, "misses": 0}
+# video id -> set of the loaded playlists of the library that contain it
+library_index = {}
+# video id -> task loading its description
+description_tasks = {}
+# video id -> task loading its skip segments
+segment_tasks = {}
 
 
 class Video(Playable):
-    def __init__(self, id="", title="", description="", author="", playlistItemId=""):
-        super().__init__(title, author, id)
-        self.description = description
-        self.playlistItemId = playlistItemId  # useful for editing playlist
-        self.skipSegments = []
+    """A library holds tens of thousands of videos: they are slotted, their
+    authors are interned and their description is only loaded when shown"""
+
+    __slots__ = (
+        "description",  # None until loaded, see [get_description]
+        "skipSegments",
+        "skipSegmentsDone",
+    )
+
+    def __init__(self, id="", title="", author=""):
+        super().__init__(title, sys.intern(author), id)
+        self.description = None
+        self.skipSegments = ()
         self.skipSegmentsDone = False
-        self.audio_url = ""
-        self.video_url = ""
-        self.segmentTask = None
+
+    def get_description(self):
+        """Returns the description, or None while it is loaded in the background
+        from the store (or the api if it is not stored)"""
+        if self.description is None and self.id:
+            if self.id not in description_tasks:
+                task = asyncio.create_task(self.load_description())
+                description_tasks[self.id] = task
+                task.add_done_callback(lambda _: description_tasks.pop(self.id, None))
+        return self.description
+
+    async def load_description(self):
+        description = store.get_description(self.id)
+        if description is None:
+            response = None
+            try:
+                response = await request_executor.execute(
+                    lambda: youtube.videos.list(
+                        caller="Video", part="snippet", id=self.id
+                    )
+                )
+            except googleapiclient.errors.HttpError:
+                log.critical("Error while loading the description of a video")
+            if not response or not response["items"]:
+                return
+            description = response["items"][0]["snippet"]["description"]
+        self.description = description
 
     def mpris_url(self):
         return f"youtu.be/{self.id}"
 
-    async def load_url(self, video=False):
-        await self.get_url(video)
+    async def load_url(self, video=False, priority=USER):
+        await self.get_url(video, priority)
 
-    def url_by_mode(self, video=False):
+    def format_by_mode(self, video=False):
         if video:
-            return self.video_url
-        return self.audio_url
-
-    async def _get_url(self, format="best"):
-
-        sort = ""  # sort to be applied to the results
-
-        command = f"yt-dlp --no-warnings --format {format} {sort} --print urls --no-playlist https://youtu.be/{self.id}"
-        log.info(f"Running {command}")
-        proc = await asyncio.create_subprocess_shell(
-            command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        [urls, stderr] = await proc.communicate()
-        urls = urls.decode().splitlines()
-        if urls:
-            return urls[0]
-        else:
-            return ""
+            return "best"
+        return "bestaudio/best"
 
-    async def get_url(self, video=False):
+    async def get_url(self, video=False, priority=USER):
         """Return the url for the audio stream of the video"""
 
         if self.id == "":
             return ""
 
-        url = self.url_by_mode(video)
+        # the segments are only needed once the video plays
+        self.load_skip_segments()
+        url = url_cache.get(self.id, self.format_by_mode(video))
         if url:
-            # checking if url has expired
-            parsed_url = urlparse(url)
-            expire = int(parse_qs(parsed_url.query)["expire"][0])
-            if expire < time():
-                return url
+            return url
 
         log.info(f"Fetching url for {self.title} ({self.id})")
 
-        self.video_url, self.audio_url, _ = await asyncio.gather(
-            self._get_url("best"),
-            self._get_url("bestaudio/best"),
-            self.get_skip_segment(),
-        )
-        log.info(f"Obtained urls for {self.title} ({self.id})")
+        video_url, audio_url = await resolve(self.id, priority)
+        url_cache.put(self.id, self.format_by_mode(True), video_url)
+        url_cache.put(self.id, self.format_by_mode(False), audio_url)
+        log.info(f"Obtained urls for {self.title} ({self.id}), {url_cache.stats}")
 
-        return self.url_by_mode(video)
+        if video:
+            return video_url
+        return audio_url
+
+    def load_skip_segments(self):
+        """Start loading the skip segments in the background if needed"""
+        if self.skipSegmentsDone or not self.id or self.id in segment_tasks:
+            return
+        task = asyncio.create_task(self.get_skip_segment())
+        segment_tasks[self.id] = task
+        task.add_done_callback(lambda _: segment_tasks.pop(self.id, None))
 
     async def get_skip_segment(self):
         if self.id == "":
@@ -98,7 +139,41 @@ class Video(Playable):
         return False
 
 
+class VideoRegistry:
+    """The single Video object of each video id, shared by every list holding
+    it, so that its urls, skip segments and description are loaded once.
+    Videos no list holds anymore are forgotten"""
+
+    def __init__(self):
+        self.videos = weakref.WeakValueDictionary()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, id, title, author):
+        video = self.videos.get(id)
+        if video is None:
+            self.stats["misses"] += 1
+            video = Video(id, title, author)
+            self.videos[id] = video
+        else:
+            self.stats["hits"] += 1
+            video.title = title  # the details may have changed since
+            video.author = sys.intern(author)
+        return video
+
+    def hit_rate(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0
+
+    def __len__(self):
+        return len(self.videos)
+
+
+video_registry = VideoRegistry()
+
+
 class YoutubeList(Playlist):
+    in_library = False  # whether the list is indexed in [library_index]
+
     def __init__(self):
         super().__init__()
         self.current_index = 0
@@ -107,43 +182,165 @@ class YoutubeList(Playlist):
 
         self.nb_loaded = 0
         self.elements = []
+        # id -> indexes of its occurrences in elements, in increasing order,
+        # as a playlist may contain a video more than once
+        self.index = {}
         self.size = 0
 
-        self.is_loading = Lock()
+        self.is_loading = asyncio.Lock()
+        self.load_task = None
+        self.nb_pages = 0  # number of pages fetched since creation
+        # whether the pages must be requested again from the first one,
+        # see [YoutubePlaylist.pages_shifted]
+        self.restart_paging = False
+        self.use_store = True  # False once the user asked for fresh content
+        self.loading_all = False
+        self.interrupted = False  # whether an outage stopped the loading
+        connectivity.subscribe(self.connectivity_changed)
 
     def __contains__(self, item):
+        """Only looks at what is loaded, and never waits for the network"""
         if type(item) is Video:
             item = item.id
-
-        # to gain time we avoid as much as possible api calls
-        for v in self.elements:
-            if v.id == item:
-                return True
-        while self.next_page is not None:
-            last_index = len(self.elements) - 1
-            self.load_next_page()
-            for v in self.elements[last_index:]:
-                if v.id == item:
-                    return True
-        return False
-
-    def request(self, who, **what):
+        return item in self.index
+
+    def append(self, element):
+        self.index.setdefault(element.id, []).append(len(self.elements))
+        self.elements.append(element)
+        # a lazy order draws among the loaded elements, and the order of a list
+        # of unknown size (a search) grows as its pages come in
+        self.order.extend(len(self.elements))
+        if self.in_library:
+            library_index.setdefault(element.id, set()).add(self)
+
+    def shift_index(self, start, shift):
+        """Add [shift] to the indexes from [start] on"""
+        for indexes in self.index.values():
+            for k, i in enumerate(indexes):
+                if i >= start:
+                    indexes[k] = i + shift
+
+    def insert(self, index, element):
+        """Insert [element] at [index] patching the index and the order"""
+        self.shift_index(index, 1)
+        bisect.insort(self.index.setdefault(element.id, []), index)
+        self.elements.insert(index, element)
+        self.nb_loaded += 1
+        self.size += 1
+        self.order_insert(index)
+        if self.in_library:
+            library_index.setdefault(element.id, set()).add(self)
+
+    def pop(self, id):
+        """Remove the first occurrence of [id] patching the index and the order"""
+        indexes = self.index[id]
+        index = indexes.pop(0)
+        if not indexes:
+            del self.index[id]
+        element = self.elements.pop(index)
+        self.shift_index(index + 1, -1)
+        self.nb_loaded -= 1
+        self.size -= 1
+        self.order_remove(index)
+        if self.in_library and id not in self.index:
+            library_index.get(id, set()).discard(self)
+        return element
+
+    def clear(self):
+        if self.in_library:
+            for id in self.index:
+                library_index.get(id, set()).discard(self)
+        self.elements = []
+        self.index = {}
+
+    async def request(self, who, page_key=None, batch=False, **what):
+        """Execute the request [who](**what). If [page_key] is given, the response
+        is stored with its ETag and revalidated on the next request.
+        If [batch] is True, the request may be sent alongside others"""
+        if page_key is not None:
+            response, _ = await self.conditional_request(
+                who, page_key, batch, **what
+            )
+            return response
+        return await self._execute(who, None, batch, **what)
+
+    async def conditional_request(self, who, page_key, batch=False, **what):
+        """Returns (response, unchanged) where [unchanged] is True if the server
+        answered that the response stored under [page_key] is still valid"""
+        cached = store.get_page(page_key)
+        etag = cached[0] if cached else None
         try:
-            if who(**what) is not None:
-                result = who(**what).execute()
-            else:
-                return None
-        except google.auth.exceptions.RefreshError:
-            youtube.get_authenticated_service(refresh=True)
-            result = who(**what).execute()
-            log.warning("Error with request")
-        return result
-
-    def _load_next_page(self):
+            response = await self._execute(who, etag, batch, **what)
+        except googleapiclient.errors.HttpError as e:
+            if cached and e.resp.status == 304:
+                page_stats["revalidated"] += 1
+                return cached[1], True
+            raise e
+        if response is None:
+            if cached and request_executor.offline():
+                return cached[1], True  # the stored page is all we have
+            return None, False
+        page_stats["downloaded"] += 1
+        if "etag" in response:
+            store.set_page(page_key, response["etag"], response)
+        return response, False
+
+    async def _execute(self, who, etag, batch, **what):
+        def build():
+            request = who(caller=type(self).__name__, **what)
+            if request is not None and etag:
+                request.headers["If-None-Match"] = etag
+            return request
+
+        return await request_executor.execute(build, batch)
+
+    async def _load_next_page(self):
         pass
 
-    def load_next_page(self):
-        self._load_next_page()
+    async def load_next_page(self):
+        nb_pages = self.nb_pages
+        async with self.is_loading:
+            if nb_pages != self.nb_pages:
+                return  # a page was loaded while we were waiting
+            await self._load_next_page()
+            self.nb_pages += 1
+
+    def is_busy(self):
+        return self.load_task is not None and not self.load_task.done()
+
+    def load_in_background(self, all_pages=False):
+        """Start loading the next page (or every remaining page if [all_pages])
+        without waiting for it"""
+        if self.is_busy():
+            if all_pages and not self.loading_all:
+                # the remaining pages follow the page being loaded
+                self.loading_all = True
+                self.load_task = asyncio.create_task(
+                    self.load_all_after(self.load_task)
+                )
+            return self.load_task
+        self.loading_all = all_pages
+        if all_pages:
+            self.load_task = asyncio.create_task(self.load_all())
+        else:
+            self.load_task = asyncio.create_task(self.load_next_page())
+        return self.load_task
+
+    async def load_all_after(self, task):
+        """Load every remaining page once [task] is done, cancelling this one
+        cancels [task] too"""
+        await task
+        await self.load_all()
+
+    def connectivity_changed(self, online):
+        """The loading interrupted by an outage is resumed when the connection
+        is back"""
+        if not online:
+            self.interrupted = self.is_busy()
+        elif self.interrupted:
+            self.interrupted = False
+            if self.has_more():
+                self.load_in_background(all_pages=self.loading_all)
 
     def update_tokens(self, response):
         self.next_page = (
@@ -159,16 +356,9 @@ class YoutubeList(Playlist):
 
         if index < self.nb_loaded:
             return self.elements[index]
-        while (
-            index > self.nb_loaded
-            and self.next_page is not None
-            and not self.is_loading.locked()
-        ):
-            self.load_next_page()
-        if self.is_loading.locked():
-            return Video()
-        if self.nb_loaded == 0:
-            self.load_next_page()
+        if self.nb_loaded == 0 and self.is_busy():
+            return Video()  # the first page is on its way
+        await self.load_until(index)
         if self.next_page is None:
             self.size = self.nb_loaded
         if self.size == 0:  # might happen if no internet
@@ -178,83 +368,260 @@ class YoutubeList(Playlist):
             return self.elements[-1]
         return self.elements[index]
 
+    def has_more(self):
+        return self.next_page is not None or self.nb_loaded == 0 or self.restart_paging
+
+    def paging_state(self):
+        """Changes every time a page is loaded"""
+        return self.nb_loaded, self.next_page, self.restart_paging
+
+    async def load_until(self, index):
+        """Load pages until [index] is loaded or there is nothing left to load"""
+        while index >= self.nb_loaded and self.has_more():
+            state = self.paging_state()
+            await self.load_next_page()
+            if self.paging_state() == state:
+                break  # the page could not be loaded
+
     async def get_item_list(self, start, end):
-        while end + 1 > self.nb_loaded and self.next_page is not None:
-            self.load_next_page()
+        """Never waits for the network: missing pages are requested in the
+        background and will be displayed on a later frame"""
+        prefetch_stats["renders"] += 1
+        if end > self.nb_loaded and self.has_more():
+            prefetch_stats["misses"] += 1
+            self.load_in_background()
         max_index = min(end, self.nb_loaded)
         return self.elements[start:max_index]
 
-    def load_all(self):
-        self.is_loading.acquire()
-        while self.next_page is not None or self.nb_loaded == 0:
-            self._load_next_page()
-        log.info("PHERE")
+    async def load_all(self):
+        while self.has_more():
+            state = self.paging_state()
+            await self.load_next_page()
+            if self.paging_state() == state:
+                break  # nothing was loaded, we are probably offline
         self.size = self.nb_loaded
-        self.is_loading.release()
-
-    async def load_all_async(self):
-        loop = asyncio.get_running_loop()
-        loop.run_in_executor(None, self.load_all())
 
     async def reload(self):
+        if self.is_busy():
+            self.load_task.cancel()
         self.nb_loaded = 0
         # self.size = 0  # not necessary I think
-        self.elements = []
+        self.clear()
+        if self.order.lazy:
+            self.order = PlayOrder(lazy=True)
         self.next_page = None
         self.prev_page = None
+        self.restart_paging = False
+        self.use_store = False
 
-        self.load_next_page()
+        await self.load_next_page()
 
     async def get_max_index(self):
         return self.nb_loaded - 1
 
+    async def shuffle(self):
+        """Only the loaded elements are shuffled at once, so that playback
+        starts without waiting for the remaining pages: they join the draw
+        of the next element as they come in"""
+        self.order = PlayOrder(self.nb_loaded, lazy=True)
+        self.shuffled = True
+        if self.has_more():
+            self.load_in_background(all_pages=True)
+
+    async def fill_order(self, position):
+        """Only a lazy order waits for the next pages, the others already hold
+        every index of the list"""
+        if not self.order.lazy:
+            return
+        while position >= len(self.order) and self.has_more():
+            state = self.paging_state()
+            await self.load_next_page()
+            if self.paging_state() == state:
+                break  # the page could not be loaded
+
+
+class LibraryMatches(Playlist):
+    """Videos of the loaded playlists of the library matching a query"""
+
+    def __init__(self, query, limit=MAX_RESULTS):
+        super().__init__()
+        self.title = query
+        query = query.lower()
+        for id, playlists in library_index.items():
+            if len(self.elements) >= limit:
+                break
+            for p in playlists:
+                if id not in p.index:
+                    continue
+                video = p.elements[p.index[id][0]]
+                if query in video.title.lower() or query in video.author.lower():
+                    self.elements.append(video)
+                break
+        self.size = len(self.elements)
+        self.order = PlayOrder(self.size)
+
+
+class Prefetcher(PropertyObject):
+    """Keep [prefetchPages] pages loaded ahead of the rows displayed by a widget"""
+
+    def __init__(self):
+        super().__init__()
+        self.prefetchPages = None
+        self._add_property("prefetchPages", 2)
+        self.source = None
+        self.task = None
+        self.target = 0
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+    def watch(self, source, last_visible):
+        """Called on every frame with the index of the last visible row"""
+        if source is not self.source:
+            self.cancel()  # the user left the list, its prefetch is useless
+            self.source = source
+            self.target = 0
+        if not isinstance(source, YoutubeList):
+            return
+        target = last_visible + self.prefetchPages * MAX_RESULTS
+        if target < self.target and self.task is not None:
+            # the user scrolled back, the page being loaded is not needed yet
+            if target < source.nb_loaded:
+                self.cancel()
+        self.target = target
+        busy = self.task is not None and not self.task.done()
+        if api_usage.budget_low() or request_executor.offline():
+            # the quota left is kept for what the user asks for,
+            # and there is no point in prefetching during an outage
+            return
+        if not busy and target >= source.nb_loaded and source.has_more():
+            self.task = asyncio.create_task(source.load_until(target))
+
 
 class YoutubePlaylist(YoutubeList):
+    in_library = True
+
     def __init__(self, id, title, nb_videos):
 
         super().__init__()
         self.title = title
         self.id = id
         self.size = nb_videos
-        self.order = [i for i in range(self.size)]  # used for shuffling
+        self.order = PlayOrder(self.size)  # used for shuffling
         self.api_object = youtube.playlist_items
-        self.is_loading = Lock()
+        self.nb_items = 0  # number of playlist items fetched, even unavailable
+        # video id -> its playlist item id, or None if it is not in the playlist,
+        # as answered by the server for videos that may not be loaded
+        self.membership = {}
+        # video id -> its playlist item id (or its id until the server gives
+        # one), or None if it was removed, for the edits not sent yet
+        self.edits = {}
+        # video id -> playlist item ids of its loaded occurrences, in order,
+        # the videos being shared with the other lists
+        self.item_ids = {}
+        # playlist item ids loaded before the paging restarted, that are
+        # skipped when their page comes again, see [restart_paging]
+        self.repaged_items = set()
+        self.verify_task = None
+        # the next page of items is requested while the details
+        # of the current one are resolved
+        self.items_task = None
+        self.items_token = None
 
     async def init(self):
-        self.load_next_page()  # we load the first page
-
-    def _add_videos(self, id_list):
+        await self.load_next_page()  # we load the first page
+
+    def clear(self):
+        super().clear()
+        self.item_ids = {}
+        self.repaged_items = set()
+
+    async def _fetch_videos(self, video_id_list):
+        """Returns a dict id -> (title, author, available)
+        reading the store first and querying the api for the missing videos.
+        When reloading, every video is revalidated against the api"""
+
+        videos = store.get_videos(video_id_list)
+        if self.use_store:
+            missing = [id for id in video_id_list if id not in videos]
+            page_key = None
+        else:
+            missing = video_id_list
+            page_key = "videos:" + ",".join(missing)
+        if not missing:
+            return videos
 
         to_request = "id, snippet, status, contentDetails"
-        video_id_list = [v[0] for v in id_list]
         args = {
             "part": to_request,
-            "id": ",".join(video_id_list),
+            "id": ",".join(missing),
         }
         try:
-            response = self.request(youtube.videos.list, **args)
+            response = await self.request(
+                youtube.videos.list, page_key, batch=True, **args
+            )
         except googleapiclient.errors.HttpError:
             log.critical("Error while adding videos to playlist")
+            return videos
+        if not response:
+            return videos
 
-        nb_added = 0
-        for i, v in enumerate(response["items"]):
-            if not self.check_video_availability(v):
-                log.warning(f"Video unavailable {v['snippet']['title']}")
-                self.removeMax()
-                continue
-            self.elements.append(
-                Video(
+        fetched = []
+        for v in response["items"]:
+            fetched.append(
+                (
                     v["id"],
                     v["snippet"]["title"],
                     v["snippet"]["description"],
                     v["snippet"]["channelTitle"],
-                    id_list[i][1]  # playlist_items_id
-                    # TODO: not sure if order is preserved
+                    self.check_video_availability(v),
                 )
             )
+        store.add_videos(fetched)
+        for id, title, _, author, available in fetched:
+            videos[id] = (title, author, available)
+        return videos
+
+    async def _add_videos(self, id_list):
+
+        videos = await self._fetch_videos([v[0] for v in id_list])
+        return self._append_videos(id_list, videos)
+
+    def _append_videos(self, id_list, videos):
+        nb_added = 0
+        for video_id, playlist_item_id in id_list:
+            if playlist_item_id in self.repaged_items:
+                self.repaged_items.discard(playlist_item_id)
+                continue  # already loaded, the paging restarted
+            if video_id not in videos:
+                continue  # deleted videos are not returned by the api
+            title, author, available = videos[video_id]
+            if not available:
+                log.warning(f"Video unavailable {title}")
+                continue
+            if self.edits.get(video_id, "") is None:
+                continue  # removed, but the removal may not be sent yet
+            self.item_ids.setdefault(video_id, []).append(playlist_item_id)
+            self.append(video_registry.get(video_id, title, author))
             nb_added += 1
         return nb_added
 
+    def load_from_store(self):
+        """Load the whole playlist from the store,
+        returns False if the playlist is not stored"""
+        id_list = store.get_playlist_items(self.id)
+        if id_list is None:
+            return False
+        videos = store.get_videos([v[0] for v in id_list])
+        self.nb_items = len(id_list)
+        self.nb_loaded += self._append_videos(id_list, videos)
+        self.next_page = None
+        self.size = self.nb_loaded
+        self.order_truncate(self.size)
+        return True
+
     def check_video_availability(self, video):
         # this condition is maybe too strong as it excludes non-repertoriated
         result = video["status"]["privacyStatus"] == "public"
@@ -266,73 +633,291 @@ class YoutubePlaylist(YoutubeList):
                 result = result and "FR" in t["allowed"]
         return result
 
-    def _load_next_page(self):
-        to_request = "id, snippet, status, contentDetails"
-        args = {
-            "part": to_request,
+    def items_args(self, page_token):
+        return {
+            "part": "id, snippet, status, contentDetails",
             "playlistId": self.id,
             "maxResults": MAX_RESULTS,
-            "pageToken": self.next_page,
+            "pageToken": page_token,
         }
+
+    async def _fetch_items(self, page_token):
+        return await self.request(
+            self.api_object.list,
+            self.page_key(page_token),
+            **self.items_args(page_token),
+        )
+
+    def cancel_items_task(self):
+        if self.items_task is not None:
+            self.items_task.cancel()
+        self.items_task = None
+        self.items_token = None
+
+    async def _load_next_page(self):
+        if self.nb_loaded == 0 and self.use_store and self.load_from_store():
+            return
+        if self.restart_paging:
+            self.restart_paging = False
+            self.cancel_items_task()
+            self.next_page = None
+            self.nb_items = 0
+            self.repaged_items = {
+                item_id for ids in self.item_ids.values() for item_id in ids if item_id
+            }
+
+        task = self.items_task
         try:
-            response = self.request(self.api_object.list, **args)
-        except googleapiclient.errors.HttpError as e:
+            if task is not None and self.items_token == self.next_page:
+                response = await task
+            else:
+                self.cancel_items_task()
+                response = await self._fetch_items(self.next_page)
+        except googleapiclient.errors.HttpError:
             log.critical("Error when querying playlist")
-            raise e
+            response = None
+        finally:
+            if self.items_task is task:  # not replaced by a reload meanwhile
+                self.items_task = None
+        if not response:
+            return
+
+        if "nextPageToken" in response:
+            self.items_token = response["nextPageToken"]
+            self.items_task = asyncio.create_task(self._fetch_items(self.items_token))
 
         idList = []
         for v in response["items"]:
             idList.append((v["snippet"]["resourceId"]["videoId"], v["id"]))
-        self.nb_loaded += self._add_videos(idList)
+        if self.nb_loaded == 0:
+            self.nb_items = 0
+        # nothing is modified before the last await, so that a cancelled
+        # prefetch leaves the playlist as it was
+        self.nb_loaded += await self._add_videos(idList)
+        store.add_playlist_items(self.id, self.nb_items, idList)
+        self.nb_items += len(idList)
         self.update_tokens(response)
         if self.next_page is None:
             log.info(f"{self.size}, {self.nb_loaded}")
+            store.set_complete(self.id)
+            self.repaged_items = set()
             self.size = self.nb_loaded
-            self.removeMax()
+            self.order_truncate(self.size)
+
+    def page_key(self, page_token):
+        return f"playlistItems:{self.id}:{page_token}"
 
-    def load_next_page(self):
-        if self.is_loading.locked():
+    async def revalidate_first_page(self):
+        """Revalidate the first page of the playlist against its stored ETag.
+        Returns (response, unchanged), [response] being None on failure"""
+        if store.get_playlist_items(self.id) is None:
+            return None, False
+        try:
+            return await self.conditional_request(
+                self.api_object.list, self.page_key(None), **self.items_args(None)
+            )
+        except googleapiclient.errors.HttpError:
+            log.critical("Error when querying playlist")
+            return None, False
+
+    async def revalidate(self):
+        """Check the stored copy of the playlist against the server. Only the
+        first page is revalidated: an addition or a removal anywhere changes
+        the number of items it reports, hence its ETag"""
+        response, unchanged = await self.revalidate_first_page()
+        if response is None or unchanged:
             return
-        self.is_loading.acquire()
-        self._load_next_page()
-        self.is_loading.release()
+        log.info(f"{self.title} changed on the server")
+        if self.nb_loaded:
+            await self.reload(force=True, first_page=response)
+        else:
+            # requested from the api when opened, with the stored video details
+            store.set_complete(self.id, False)
+
+    async def reload(self, force=False, first_page=None):
+        """Reload the playlist if its first page changed, or if [force].
+        [first_page] is the response to the first page if it was just
+        requested, so that it is not requested again"""
+        if not force and self.nb_loaded:
+            first_page, unchanged = await self.revalidate_first_page()
+            if unchanged:
+                log.info(f"{self.title} is unchanged, {page_stats}")
+                return
+        self.cancel_items_task()
+        if first_page is not None:
+            # picked up by [_load_next_page] as a prefetched first page
+            self.items_task = asyncio.get_running_loop().create_future()
+            self.items_task.set_result(first_page)
+        self.membership = {}  # the answers of the server may be outdated
+        await super().reload()
+        log.info(f"Reloaded {self.title}, {page_stats}")
+
+    def known_membership(self, video_id):
+        """Whether [video_id] is in the playlist, None if it is not known yet
+        (see [has_video]), never waits"""
+        if video_id in self.edits:
+            return self.edits[video_id] is not None
+        if video_id in self.membership:
+            return self.membership[video_id] is not None
+        if video_id in self.index:
+            return True
+        if self.nb_loaded and self.next_page is None:
+            return False  # the whole playlist is loaded
+        return None
+
+    async def query_membership(self, video_id):
+        """Returns the playlist item id of [video_id] in the playlist,
+        or None if it is not in it. Raises an error if the request failed"""
+        args = {
+            "part": "id",
+            "playlistId": self.id,
+            "videoId": video_id,
+            "maxResults": 1,
+        }
+        response = await self.request(self.api_object.list, batch=True, **args)
+        if response is None:
+            raise ConnectionError("Not connected to Youtube")
+        if response["items"]:
+            return response["items"][0]["id"]
+        return None
+
+    async def has_video(self, video_id):
+        """Whether [video_id] is in the playlist, asking the server only if it
+        is not known. Returns None if the server could not be asked, the
+        failure is not remembered"""
+        known = self.known_membership(video_id)
+        if known is not None:
+            return known
+        try:
+            item_id = await self.query_membership(video_id)
+        except (googleapiclient.errors.HttpError, ConnectionError):
+            log.critical("Error when querying playlist")
+            return None
+        self.membership[video_id] = item_id
+        return self.known_membership(video_id)
 
-    def add(self, video):
+    async def add_remote(self, video_id):
+        """Add [video_id] at the top of the playlist on the server and return
+        its playlist item id. Raises an error if the request failed"""
         args = {
             "part": "snippet",
             "body": {
                 "snippet": {
                     "playlistId": self.id,
-                    "resourceId": {"kind": "youtube#video", "videoId": video.id},
+                    "resourceId": {"kind": "youtube#video", "videoId": video_id},
                 },
                 "position": 0,
             },
         }
+        response = await self.request(self.api_object.insert, **args)
+        if response is None:
+            raise ConnectionError("Not connected to Youtube")
+        return response["id"]
+
+    async def remove_remote(self, video_id, playlistItemId):
+        """Remove [video_id] from the playlist on the server.
+        Raises an error if the request failed"""
+        response = await self.request(self.api_object.delete, id=playlistItemId)
+        if response is None:
+            raise ConnectionError("Not connected to Youtube")
+
+    def get_item_id(self, video_id):
+        """Returns the playlist item id of [video_id] if it is known"""
+        if video_id in self.index:
+            return self.item_ids.get(video_id, [""])[0]
+        return self.membership.get(video_id) or ""
+
+    async def add(self, video):
         try:
-            self.request(self.api_object.insert, **args)
-        except googleapiclient.errors.HttpError:
+            playlistItemId = await self.add_remote(video.id)
+        except (googleapiclient.errors.HttpError, ConnectionError):
             log.critical("Error while adding video to playlist")
-        self.reload()  # we refresh the content
+            return
+        self.insert_local(video, playlistItemId)
 
-    def remove(self, video):
-        playlistItemId = ""
-        for v in self.elements:
-            if v.id == video.id:
-                playlistItemId = v.playlistItemId
-                break
+    async def remove(self, video):
         try:
-            self.request(self.api_object.delete, id=playlistItemId)
-        except googleapiclient.errors.HttpError:
+            await self.remove_remote(video.id, self.get_item_id(video.id))
+        except (googleapiclient.errors.HttpError, ConnectionError):
             log.critical("Error while removing video from playlist")
-        self.reload()
-
-    def removeMax(self):
-        if not self.order:
             return
-        index_max = max(range(len(self.order)), key=self.order.__getitem__)
-        if self.order[index_max] >= self.size:
-            self.order.pop(index_max)
-            self.removeMax()  # Hopefully it will never go deep
+        self.remove_local(video)
+
+    def set_item_id(self, video_id, playlistItemId):
+        """Record the playlist item id given by the server to a video
+        that was added before the server answered"""
+        ids = self.item_ids.get(video_id, [])
+        if "" in ids:
+            ids[ids.index("")] = playlistItemId
+        if self.edits.get(video_id) is not None:
+            self.edits[video_id] = playlistItemId
+        store.set_playlist_item_id(self.id, video_id, playlistItemId)
+
+    def edit_done(self, video_id):
+        """Forget the local edits of [video_id] once they were sent (or
+        dropped), the server is asked again when its membership is needed"""
+        self.edits.pop(video_id, None)
+        self.membership.pop(video_id, None)
+
+    def pages_shifted(self):
+        """Called once an edit reached the server: the page tokens are offsets,
+        so the pages not loaded yet are shifted by one"""
+        self.restart_paging = self.next_page is not None
+
+    def insert_local(self, video, playlistItemId, verify=True):
+        """Apply the addition of [video] at the top of the playlist
+        to the loaded items and to the store. [verify] is True if the
+        addition was already sent"""
+        self.edits[video.id] = playlistItemId or video.id
+        if not self.nb_loaded:
+            return  # it will be there when the first page is loaded
+        if video.id in self.index:
+            return  # loaded from the store, where the edit was kept
+        # the details of the video were stored when its list was loaded
+        self.item_ids.setdefault(video.id, []).insert(0, playlistItemId)
+        self.insert(0, video)
+        self.nb_items += 1
+        store.insert_playlist_item(self.id, 0, video.id, playlistItemId)
+        if verify:
+            self.pages_shifted()
+            self.verify_in_background()
+
+    def remove_local(self, video, verify=True):
+        """Apply the removal of [video] to the loaded items and to the store.
+        [verify] is True if the removal was already sent"""
+        self.edits[video.id] = None
+        if video.id not in self.index:
+            return
+        self.pop(video.id)
+        ids = self.item_ids.pop(video.id, [])[1:]
+        if ids:
+            self.item_ids[video.id] = ids
+        self.nb_items -= 1
+        store.remove_playlist_item(self.id, video.id)
+        if verify:
+            self.pages_shifted()
+            self.verify_in_background()
+
+    def verify_in_background(self):
+        self.verify_task = asyncio.create_task(self.verify())
+
+    async def verify(self):
+        """Compare the first page of the server with the loaded items,
+        and reload the playlist if they differ"""
+        try:
+            response = await self._fetch_items(None)
+        except googleapiclient.errors.HttpError:
+            log.critical("Error when querying playlist")
+            return
+        if not response:
+            return
+        server = [v["snippet"]["resourceId"]["videoId"] for v in response["items"]]
+        # unavailable videos are not loaded
+        server = [id for id in server if id in self.index]
+        local = [v.id for v in self.elements[: len(server)]]
+        if server != local:
+            log.warning(f"{self.title} differs from the server, reloading")
+            await self.reload(force=True, first_page=response)
 
 
 class LikedVideos(YoutubePlaylist):
@@ -342,19 +927,30 @@ class LikedVideos(YoutubePlaylist):
         # we have to use a different endpoint to like videos
         self.api_object_modif = youtube.videos
 
-    def add(self, video):
-        try:
-            self.request(self.api_object_modif.rate, id=video.id, rating="like")
-        except googleapiclient.errors.HttpError:
-            log.critical("Error while adding videos to liked videos")
-        self.reload()  # we refresh the content
+    async def query_membership(self, video_id):
+        response = await self.request(
+            self.api_object_modif.getRating, batch=True, id=video_id
+        )
+        if response is None:
+            raise ConnectionError("Not connected to Youtube")
+        if response["items"] and response["items"][0]["rating"] == "like":
+            return video_id  # there is no playlist item id for likes
+        return None
+
+    async def add_remote(self, video_id):
+        response = await self.request(
+            self.api_object_modif.rate, id=video_id, rating="like"
+        )
+        if response is None:
+            raise ConnectionError("Not connected to Youtube")
+        return ""  # there is no playlist item id for likes
 
-    def remove(self, video):
-        try:
-            self.request(self.api_object_modif.rate, id=video.id, rating="none")
-        except googleapiclient.errors.HttpError:
-            log.critical("Error while removing like from video")
-        self.reload()  # we refresh the content
+    async def remove_remote(self, video_id, playlistItemId):
+        response = await self.request(
+            self.api_object_modif.rate, id=video_id, rating="none"
+        )
+        if response is None:
+            raise ConnectionError("Not connected to Youtube")
 
 
 class YoutubePlaylistList(YoutubeList):
@@ -363,17 +959,108 @@ class YoutubePlaylistList(YoutubeList):
         self.elements = []
         self.nb_loaded = 1
         self.api_object = youtube.playlists
+        # revalidation of what was loaded from the store, see [revalidate]
+        self.revalidate_task = None
 
     async def init(self):
 
-        loop = asyncio.get_running_loop()
+        if self.load_from_store():
+            if self.elements:
+                self.elements[0].load_in_background(all_pages=True)
+            self.revalidate_task = asyncio.create_task(self.revalidate())
+            return
+
         await asyncio.gather(self.get_liked_videos(), self.load_next_page())
-        self.load_all()
+        await self.load_all()
+        self.save()
+        # nothing is stored yet, we load the first page of every playlist at
+        # once so that their video details are requested in a few batches
+        if not api_usage.budget_low():
+            for p in self.elements[1:]:
+                p.load_in_background()
         # await asyncio.gather(*[p.init() for p in self.elements])
-        loop.run_in_executor(None, self.elements[0].load_all)
+        if self.elements:
+            self.elements[0].load_in_background(all_pages=True)
+
+    def save(self):
+        store.set_playlists(
+            [
+                (p.id, p.title, p.size, isinstance(p, LikedVideos))
+                for p in self.elements
+            ]
+        )
 
-    async def load_next_page(self):
-        self._load_next_page()
+    def page_key(self, page_token):
+        return f"playlists:{page_token}"
+
+    def list_args(self, page_token):
+        return {
+            "part": "id, snippet, contentDetails",
+            "maxResults": MAX_RESULTS,
+            "mine": True,
+            "pageToken": page_token,
+        }
+
+    async def revalidate(self, contents=True):
+        """Check the playlists started from the store against the server, in
+        the background: the list of playlists then, if [contents], the first
+        page of every stored playlist. Returns whether the list changed"""
+        if api_usage.budget_low() or request_executor.offline():
+            return False
+        try:
+            response, unchanged = await self.conditional_request(
+                self.api_object.list, self.page_key(None), **self.list_args(None)
+            )
+        except googleapiclient.errors.HttpError:
+            log.critical("Error while loading list of playlists")
+            return False
+        changed = False
+        if response is not None and not unchanged:
+            changed = await self.refresh()
+        if contents and not api_usage.budget_low():
+            await asyncio.gather(*[p.revalidate() for p in self.elements])
+        return changed
+
+    async def refresh(self):
+        """Request the list of playlists again, keeping the playlists already
+        known so that their loaded items are kept.
+        Returns whether the list changed"""
+        fresh = YoutubePlaylistList()
+        await asyncio.gather(fresh.get_liked_videos(), fresh.load_next_page())
+        await fresh.load_all()
+        if not fresh.elements:
+            return False  # the requests failed
+        known = {p.id: p for p in self.elements}
+        elements = []
+        for p in fresh.elements:
+            if p.id in known:
+                playlist = known[p.id]
+                playlist.title = p.title
+                if not playlist.nb_loaded:
+                    playlist.size = p.size
+                    playlist.order = PlayOrder(p.size)
+                p = playlist
+            elements.append(p)
+        changed = [(p.id, p.title) for p in elements] != [
+            (p.id, p.title) for p in self.elements
+        ]
+        self.elements = elements
+        self.nb_loaded = len(elements)
+        self.size = self.nb_loaded
+        self.save()
+        return changed
+
+    def load_from_store(self):
+        playlists = store.get_playlists()
+        if not playlists:
+            return False
+        for id, title, item_count, liked in playlists:
+            kind = LikedVideos if liked else YoutubePlaylist
+            self.elements.append(kind(id, title, item_count))
+        self.nb_loaded = len(self.elements)
+        self.size = self.nb_loaded
+        self.next_page = None
+        return True
 
     async def get_liked_videos(self):
         args = {
@@ -384,8 +1071,7 @@ class YoutubePlaylistList(YoutubeList):
         }
         response = []
         try:
-            await asyncio.sleep(0)
-            response = self.request(self.api_object.list, **args)
+            response = await self.request(self.api_object.list, **args)
         except googleapiclient.errors.HttpError:
             log.critical("Error while loading list of playlists")
 
@@ -400,15 +1086,14 @@ class YoutubePlaylistList(YoutubeList):
                 ),
             )
 
-    def _load_next_page(self):
-        args = {
-            "part": "id, snippet, contentDetails",
-            "maxResults": MAX_RESULTS,
-            "mine": True,
-            "pageToken": self.next_page,
-        }
+    async def _load_next_page(self):
+        response = None
         try:
-            response = self.request(self.api_object.list, **args)
+            response = await self.request(
+                self.api_object.list,
+                self.page_key(self.next_page),
+                **self.list_args(self.next_page),
+            )
         except googleapiclient.errors.HttpError:
             log.critical("Error while loading list of playlists")
 
@@ -424,7 +1109,6 @@ class YoutubePlaylistList(YoutubeList):
         self.update_tokens(response)
         self.nb_loaded += len(response["items"])
         if self.next_page is None:
-            log.info("HERE")
             self.size = self.nb_loaded
 
     async def shuffle(self):
@@ -435,16 +1119,18 @@ class YoutubePlaylistList(YoutubeList):
 
 
 class Search(YoutubePlaylist):
+    in_library = False
+
     def __init__(self, query):
 
-        super().__init__()
+        super().__init__(None, query, 0)
         self.query = query
         self.size = 1e99
         self.api_object = youtube.search
 
-        self.load_next_page()
+        self.load_in_background()
 
-    def _load_next_page(self):
+    async def _load_next_page(self):
 
         args = {
             "part": "id, snippet, contentDetails",
@@ -454,16 +1140,21 @@ class Search(YoutubePlaylist):
             "type": "video",
         }
 
-        try:
-            response = self.request(self.api_object.list, **args)
-        except googleapiclient.errors.HttpError:
-            log.critical("Error while searching for videos")
+        response = search_cache.get(self.query, self.next_page)
+        if response is None:
+            try:
+                response = await self.request(self.api_object.list, **args)
+            except googleapiclient.errors.HttpError:
+                log.critical("Error while searching for videos")
+            if not response:
+                return
+            search_cache.put(self.query, self.next_page, response)
 
         id_list = []
         for v in response["items"]:
             id_list.append((v["id"]["videoId"], ""))
 
-        self.nb_loaded += self._add_videos(id_list)
+        self.nb_loaded += await self._add_videos(id_list)
         self.update_tokens(response)
 
         if self.next_page is None:
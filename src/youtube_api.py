@@ -1,46 +1,233 @@
 """Youtube API wrapper"""
 # === Google API === #
+import google.auth.exceptions
 import google_auth_oauthlib.flow
 import googleapiclient.discovery
+import googleapiclient.discovery_cache
 import googleapiclient.errors
 
 import os
+import json
+import time
+import bisect
 import pickle
+import random
 import logging
+import asyncio
+import threading
 
-import socket
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from zoneinfo import ZoneInfo
 
 import google_auth_httplib2
 import httplib2
 
+from connectivity import connectivity
+from constants import dirs
+from property import PropertyObject
+
 log = logging.getLogger(__name__)
 
+# every blocking call to the api is run in this pool so that the event loop
+# (and therefore the interface and mpv) never waits on the network
+MAX_WORKERS = 4
+api_executor = ThreadPoolExecutor(
+    max_workers=MAX_WORKERS, thread_name_prefix="youtube_api"
+)
+
+
+async def run_in_worker(function, *args):
+    """Run the blocking [function] in the api worker pool
+    and wait for its result without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(api_executor, function, *args)
+
+
+# quota cost of the calls, see https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    "list": 1,
+    "getRating": 1,
+    "insert": 50,
+    "update": 50,
+    "delete": 50,
+    "rate": 50,
+}
+SEARCH_COST = 100
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]  # upper bounds in seconds
+
+
+def quota_day():
+    """The quota is reset at midnight, Pacific time"""
+    return datetime.now(ZoneInfo("America/Los_Angeles")).date().isoformat()
+
+
+class Usage:
+    """Counters of the calls made to an endpoint or by a list"""
+
+    def __init__(self):
+        self.calls = 0
+        self.units = 0
+        self.bytes = 0
+        # number of responses per latency bucket, the last one being unbounded
+        self.latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add_latency(self, latency):
+        self.latencies[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def percentile(self, p):
+        """Returns the upper bound of the bucket of the [p] percentile"""
+        total = sum(self.latencies)
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + [float("inf")], self.latencies):
+            seen += count
+            if total and seen >= p * total:
+                return bound
+        return 0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "units": self.units,
+            "bytes": self.bytes,
+            "latency_buckets": LATENCY_BUCKETS,
+            "latencies": self.latencies,
+        }
+
+
+class ApiUsage(PropertyObject):
+    """Quota and latency accounting of the api calls, per endpoint and per list.
+    If [quotaBudget] is set, background loading stops when it runs low"""
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.quotaBudget = None
+        self._add_property("quotaBudget", 0)  # 0 means no budget
+        if path is None:
+            path = os.path.join(dirs.user_cache_dir, "api_usage.json")
+        self.path = path
+        self.lock = threading.Lock()  # responses are recorded by the workers
+        self.by_endpoint = {}
+        self.by_caller = {}
+        self.day = quota_day()
+        self.units_today = 0
+        try:
+            with open(path) as f:
+                previous = json.load(f)
+            if previous["day"] == self.day:
+                self.units_today = previous["units_today"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def record_call(self, endpoint, caller, units):
+        with self.lock:
+            if quota_day() != self.day:
+                self.day = quota_day()
+                self.units_today = 0
+            self.units_today += units
+            for usage in self._usages(endpoint, caller):
+                usage.calls += 1
+                usage.units += units
+            nb_calls = self.by_endpoint[endpoint].calls
+        if nb_calls % 10 == 0:
+            self.dump()
+
+    def record_response(self, endpoint, caller, nbytes, latency):
+        with self.lock:
+            for usage in self._usages(endpoint, caller):
+                usage.bytes += nbytes
+                usage.add_latency(latency)
+
+    def _usages(self, endpoint, caller):
+        return (
+            self.by_endpoint.setdefault(endpoint, Usage()),
+            self.by_caller.setdefault(caller, Usage()),
+        )
+
+    def budget_low(self):
+        """Whether less than a tenth of the budget is left"""
+        return self.quotaBudget > 0 and self.units_today >= 0.9 * self.quotaBudget
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "day": self.day,
+                "units_today": self.units_today,
+                "budget": self.quotaBudget,
+                "endpoints": {k: v.as_dict() for k, v in self.by_endpoint.items()},
+                "callers": {k: v.as_dict() for k, v in self.by_caller.items()},
+            }
+
+    def dump(self):
+        """Write the counters as json to [path]"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+api_usage = ApiUsage()
+
 
 class YoutubeAPIObject:
+    name = ""  # name of the resource in the api
+
     def __init__(self, element=None):
         self.endpoint = element
 
-    def list(self, **args):
+    def _track(self, method, request, caller):
+        """Account for [request], made by the list [caller], in [api_usage]"""
+        endpoint = f"{self.name}.{method}"
+        units = QUOTA_COSTS[method]
+        if endpoint == "search.list":
+            units = SEARCH_COST
+        api_usage.record_call(endpoint, caller, units)
+
+        # the latency is measured from when the request is actually sent,
+        # see [BatchRequester] for requests that are not executed on their own
+        request.started = time.perf_counter()
+        postproc = request.postproc
+        execute = request.execute
+
+        def tracked_postproc(resp, content):
+            latency = time.perf_counter() - request.started
+            api_usage.record_response(endpoint, caller, len(content), latency)
+            return postproc(resp, content)
+
+        def tracked_execute(*args, **kwargs):
+            request.started = time.perf_counter()
+            return execute(*args, **kwargs)
+
+        request.postproc = tracked_postproc
+        request.execute = tracked_execute
+        return request
+
+    def list(self, caller="", **args):
+        if self.endpoint:
+            return self._track("list", self.endpoint().list(**args), caller)
+        else:
+            return None
+
+    def insert(self, caller="", **args):
         if self.endpoint:
-            return self.endpoint().list(**args)
+            return self._track("insert", self.endpoint().insert(**args), caller)
         else:
             return None
 
-    def insert(self, **args):
+    def delete(self, caller="", **args):
         if self.endpoint:
-            return self.endpoint().insert(**args)
+            return self._track("delete", self.endpoint().delete(**args), caller)
         else:
             return None
 
-    def delete(self, **args):
+    def rate(self, caller="", **args):
         if self.endpoint:
-            return self.endpoint().delete(**args)
+            return self._track("rate", self.endpoint().rate(**args), caller)
         else:
             return None
 
-    def rate(self, **args):
+    def getRating(self, caller="", **args):
         if self.endpoint:
-            return self.endpoint().rate(**args)
+            return self._track("getRating", self.endpoint().getRating(**args), caller)
         else:
             return None
 
@@ -49,6 +236,8 @@ class YoutubeAPIObject:
 
 
 class YoutubeVideoAPI(YoutubeAPIObject):
+    name = "videos"
+
     def __init__(self, youtube):
         if youtube:
             super().__init__(youtube.videos)
@@ -60,6 +249,8 @@ class YoutubeVideoAPI(YoutubeAPIObject):
 
 
 class YoutubePlaylistItemAPI(YoutubeAPIObject):
+    name = "playlistItems"
+
     def __init__(self, youtube):
         if youtube:
             super().__init__(youtube.playlistItems)
@@ -71,6 +262,8 @@ class YoutubePlaylistItemAPI(YoutubeAPIObject):
 
 
 class YoutubePlaylistAPI(YoutubeAPIObject):
+    name = "playlists"
+
     def __init__(self, youtube):
         if youtube:
             super().__init__(youtube.playlists)
@@ -82,6 +275,8 @@ class YoutubePlaylistAPI(YoutubeAPIObject):
 
 
 class YoutubeSearchAPI(YoutubeAPIObject):
+    name = "search"
+
     def __init__(self, youtube):
         if youtube:
             super().__init__(youtube.search)
@@ -92,23 +287,168 @@ class YoutubeSearchAPI(YoutubeAPIObject):
         YoutubeAPIObject.update(self, youtube.search)
 
 
-def is_connected():
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/youtube/v3/rest"
+DISCOVERY_PATH = os.path.join(dirs.user_cache_dir, "youtube.v3.json")
+
+
+def discovery_document():
+    """Returns the discovery document of the api: the local copy if any, else the
+    one shipped with googleapiclient, else the one downloaded (and kept)"""
     try:
-        # see if we can resolve the host name -- tells us if there is
-        # a DNS listening
-        REMOTE_SERVER = "one.one.one.one"
-        host = socket.gethostbyname(REMOTE_SERVER)
-        # connect to the host -- tells us if the host is actually reachable
-        s = socket.create_connection((host, 80), timeout=1)
-        s.close()
-        return True
-    except Exception:
-        log.warning("No internet connection")
-        pass  # we ignore any errors, returning False
-    return False
+        with open(DISCOVERY_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    document = googleapiclient.discovery_cache.get_static_doc("youtube", "v3")
+    if document is None:
+        log.info("Downloading the discovery document")
+        _, document = httplib2.Http(timeout=10).request(DISCOVERY_URL)
+    document = json.loads(document)
+    os.makedirs(dirs.user_cache_dir, exist_ok=True)
+    with open(DISCOVERY_PATH, "w") as f:
+        json.dump(document, f)
+    return document
+
+
+class PooledHttp(httplib2.Http):
+    """httplib2.Http keeps its connections open between requests,
+    this one also counts how often they are reused"""
+
+    def __init__(self, pool, **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+
+    def _conn_request(self, conn, *args, **kwargs):
+        self.pool.record(reused=conn.sock is not None)
+        return super()._conn_request(conn, *args, **kwargs)
+
+
+class HttpPool:
+    """Keep-alive transport of the api requests. httplib2.Http is not thread
+    safe, so each worker thread gets its own, and therefore at most one open
+    connection per host"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stats = {"transports": 0, "connections": 0, "reused": 0}
+
+    def get(self, credentials):
+        """Returns the authorized http of the calling thread"""
+        authorized = getattr(self.local, "authorized", None)
+        if authorized is None:
+            http = PooledHttp(self)
+            with self.lock:
+                self.stats["transports"] += 1
+        elif authorized.credentials is not credentials:
+            http = authorized.http  # the credentials changed, the connection stays
+        else:
+            return authorized
+        self.local.authorized = google_auth_httplib2.AuthorizedHttp(
+            credentials, http=http
+        )
+        return self.local.authorized
+
+    def record(self, reused):
+        with self.lock:
+            self.stats["reused" if reused else "connections"] += 1
+
+    def reuse_rate(self):
+        total = self.stats["reused"] + self.stats["connections"]
+        return self.stats["reused"] / total if total else 0
+
+
+class CredentialManager:
+    """Credentials of the user, refreshed in the background [REFRESH_MARGIN]
+    seconds before they expire. The same credentials object is shared by the
+    transports of every thread, so they all see the new token at once.
+    The interactive flow only runs without credentials or when the refresh
+    token was revoked"""
+
+    REFRESH_MARGIN = 300  # in seconds
+    RETRY_DELAY = 60  # in seconds
+
+    def __init__(self, data_path="data/"):
+        self.scopes = ["https://www.googleapis.com/auth/youtube"]
+        self.client_secrets_file = data_path + "client_secret.json"
+        self.path = data_path + "CREDENTIALS_PICKLE_FILE"
+        self.credentials = None
+        self.lock = threading.Lock()
+        self.task = None
+        self.stats = {"refreshes": 0, "interactive": 0}
+
+    def load(self):
+        """Load the stored credentials, or ask the user for new ones, blocking"""
+        with self.lock:
+            if self.credentials is not None:
+                return
+            if os.path.exists(self.path):
+                with open(self.path, "rb") as f:
+                    self.credentials = pickle.load(f)
+            else:
+                self.authorize()
+
+    def authorize(self):
+        flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(
+            self.client_secrets_file, self.scopes
+        )
+        self.credentials = flow.run_local_server()
+        self.stats["interactive"] += 1
+        self.save()
+
+    def save(self):
+        with open(self.path, "wb") as f:
+            pickle.dump(self.credentials, f)
+
+    def refresh(self):
+        """Get a new access token, blocking"""
+        with self.lock:
+            try:
+                self.credentials.refresh(google_auth_httplib2.Request(httplib2.Http()))
+            except google.auth.exceptions.RefreshError as e:
+                if "invalid_grant" not in str(e):
+                    raise
+                log.warning("The refresh token was revoked, authorizing again")
+                self.authorize()
+                return
+            self.stats["refreshes"] += 1
+            self.save()
+        log.info("Refreshed the access token")
+
+    def time_to_refresh(self):
+        """Seconds until the token should be refreshed, None if unknown"""
+        if self.credentials is None or self.credentials.expiry is None:
+            return None
+        left = (self.credentials.expiry - datetime.utcnow()).total_seconds()
+        return max(0, left - self.REFRESH_MARGIN)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            delay = self.time_to_refresh()
+            if delay is None or not connectivity.online:
+                await asyncio.sleep(self.RETRY_DELAY)
+                continue
+            await asyncio.sleep(delay)
+            if self.time_to_refresh() > 1:
+                continue  # refreshed in the meantime
+            try:
+                await run_in_worker(self.refresh)
+            except (google.auth.exceptions.RefreshError, *TRANSPORT_ERRORS) as e:
+                log.warning(f"Could not refresh the access token ({e})")
+                await asyncio.sleep(self.RETRY_DELAY)
+            except Exception as e:
+                # the task must outlive any error, or the token is never refreshed
+                log.critical(f"Error while refreshing the access token ({e})")
+                await asyncio.sleep(self.RETRY_DELAY)
 
 
 class Youtube:
+    """The service is only built on the first call to the api,
+    see [ensure_service]"""
+
     def __init__(self):
 
         self.youtube = None
@@ -116,35 +456,29 @@ class Youtube:
         self.videos = YoutubeVideoAPI(self.youtube)
         self.playlists = YoutubePlaylistAPI(self.youtube)
         self.playlist_items = YoutubePlaylistItemAPI(self.youtube)
-        self.credentials = None  # dirty
-        if is_connected():
-            self.get_authenticated_service()
-
-    def get_authenticated_service(self, refresh=False):
-        scopes = ["https://www.googleapis.com/auth/youtube"]
-        data_path = "data/"
-        client_secrets_file = data_path + "client_secret.json"
-        api_service_name = "youtube"
-        api_version = "v3"
-        path = data_path + "CREDENTIALS_PICKLE_FILE"
-        if not refresh and os.path.exists(path):
-            with open(path, "rb") as f:
-                self.credentials = pickle.load(f)
-        else:
-            flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(
-                client_secrets_file, scopes
-            )
-            self.credentials = flow.run_local_server()
-            with open(path, "wb") as f:
-                pickle.dump(self.credentials, f)
-        authorized_http = google_auth_httplib2.AuthorizedHttp(
-            self.credentials, http=httplib2.Http()
-        )
-        self.youtube = googleapiclient.discovery.build(
-            api_service_name,
-            api_version,  # credentials=self.credentials
-            requestBuilder=self.build_request,
-            http=authorized_http,
+        self.auth = CredentialManager()
+        self.document = None
+        self.lock = threading.Lock()
+        self.pool = HttpPool()
+
+    def ensure_service(self):
+        """Build the service if it was not already, blocking"""
+        with self.lock:
+            if self.youtube is None:
+                self.get_authenticated_service()
+
+    @property
+    def credentials(self):
+        return self.auth.credentials
+
+    def get_authenticated_service(self):
+        self.auth.load()
+        if self.document is None:
+            self.document = discovery_document()
+        # the requests are sent with the http of the worker thread, see [http]
+        self.youtube = googleapiclient.discovery.build_from_document(
+            self.document,  # credentials=self.credentials
+            http=self.http(),
         )
         self.search.update(self.youtube)
         self.videos.update(self.youtube)
@@ -153,8 +487,291 @@ class Youtube:
 
         log.info("Successfully established connection to Youtube")
 
-    def build_request(self, http, *args, **kwargs):
-        new_http = google_auth_httplib2.AuthorizedHttp(
-            self.credentials, http=httplib2.Http()
-        )
-        return googleapiclient.http.HttpRequest(new_http, *args, **kwargs)
+    def http(self):
+        """The transport to send requests with from the calling thread"""
+        return self.pool.get(self.credentials)
+
+    def execute(self, request):
+        """Send [request] (or a batch) on the connection of the calling thread,
+        blocking"""
+        return request.execute(http=self.http())
+
+
+class BatchRequester:
+    """Gather the requests submitted within [delay] seconds of each other
+    and send them to the api as a single multipart batch request"""
+
+    MAX_BATCH_SIZE = 50
+
+    def __init__(self, youtube, delay=0.05):
+        self.youtube = youtube
+        self.delay = delay
+        self.pending = []  # list of (request, future)
+        self.flush_handle = None
+        self.tasks = set()
+
+    async def submit(self, request):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((request, future))
+        if len(self.pending) >= self.MAX_BATCH_SIZE:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.delay, self.flush)
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        task = asyncio.create_task(self._send(pending))
+        # keeping a reference so that the task is not garbage collected
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _send(self, pending):
+        # the callers may have been cancelled (e.g. a prefetch) while waiting,
+        # their futures are done and must not be set again
+        pending = [p for p in pending if not p[1].done()]
+        if not pending:
+            return
+        if len(pending) == 1:
+            request, future = pending[0]
+            try:
+                result = await run_in_worker(self.youtube.execute, request)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            return
+
+        results = {}
+
+        def callback(request_id, response, exception):
+            results[request_id] = (response, exception)
+
+        batch = self.youtube.youtube.new_batch_http_request(callback=callback)
+        started = time.perf_counter()
+        for i, (request, _) in enumerate(pending):
+            request.started = started
+            batch.add(request, request_id=str(i))
+        log.info(f"Sending a batch of {len(pending)} requests")
+        try:
+            await run_in_worker(self.youtube.execute, batch)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for i, (_, future) in enumerate(pending):
+            if future.done():
+                continue
+            response, exception = results.get(str(i), (None, None))
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(response)
+
+
+# statuses worth sending the request again for
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+# a 403 with one of these reasons is transient, unlike quotaExceeded
+RETRY_REASONS = ["rateLimitExceeded", "userRateLimitExceeded", "backendError"]
+# google_auth_httplib2 wraps the errors of httplib2 in TransportError
+TRANSPORT_ERRORS = (
+    OSError,
+    httplib2.HttpLib2Error,
+    google.auth.exceptions.TransportError,
+)
+
+
+def error_reason(error):
+    """Returns the reason given by the api for the HttpError [error], or ''"""
+    try:
+        return json.loads(error.content)["error"]["errors"][0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return ""
+
+
+def is_transient(error):
+    if isinstance(error, googleapiclient.errors.HttpError):
+        status = error.resp.status
+        if status == 403:
+            return error_reason(error) in RETRY_REASONS
+        return status in RETRY_STATUSES
+    return isinstance(error, TRANSPORT_ERRORS)
+
+
+class TokenBucket:
+    """Allows [rate] requests per second on average, and bursts of [burst]"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    async def acquire(self):
+        """Take a token, waiting for one if needed. Returns the time waited"""
+        start = time.monotonic()
+        async with self.lock:
+            self.refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+        return time.monotonic() - start
+
+
+class CircuitBreaker:
+    """Opens after [threshold] consecutive transient failures, and lets a single
+    request through every [cooldown] seconds until one succeeds"""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            self.opened_at = time.monotonic()  # one try per cooldown
+            return True
+        return False
+
+    def trip(self):
+        """Open the circuit at once, e.g. when the connection is known to be down"""
+        if self.opened_at is None:
+            self.opened_at = time.monotonic()
+
+    def success(self):
+        if self.opened_at is not None:
+            log.info("The api is reachable again")
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold and self.opened_at is None:
+            log.warning("The api is unreachable, using the cached content only")
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+
+class RequestExecutor(PropertyObject):
+    """Every request to the api goes through here: requests are rate limited,
+    transient errors are retried with a jittered exponential backoff and
+    repeated failures open a circuit breaker during which only the cached
+    content is used (requests return None)"""
+
+    def __init__(self, youtube, batcher):
+        super().__init__()
+        self.youtube = youtube
+        self.batcher = batcher
+        self.maxRetries = None
+        self._add_property("maxRetries", 5)
+        self.requestRate = None  # in requests per second
+        self._add_property("requestRate", 10.0, post_change_hook=self._change_rate)
+        self.limiter = TokenBucket(self.requestRate, burst=20)
+        self.breaker = CircuitBreaker(threshold=5, cooldown=30)
+        connectivity.subscribe(self.connectivity_changed)
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "rejected": 0,  # while the circuit was open
+            "circuit_opened": 0,
+            "limiter_wait": 0.0,  # total time spent waiting for the limiter
+        }
+
+    def _change_rate(self):
+        self.limiter.rate = self.requestRate
+
+    def connectivity_changed(self, online):
+        if online:
+            self.breaker.success()
+        else:
+            self.breaker.trip()
+
+    def offline(self):
+        """Whether the circuit breaker is open"""
+        return self.breaker.is_open()
+
+    async def execute(self, build, batch=False):
+        """Send the request returned by [build]() and returns its response,
+        or None if the request could not be built or the api is unreachable.
+        Raises the HttpError of the requests that fail for good"""
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            return None
+        if self.youtube.youtube is None:
+            try:
+                await run_in_worker(self.youtube.ensure_service)
+            except TRANSPORT_ERRORS as e:
+                log.warning(f"Could not connect to youtube ({e})")
+                return None
+        refreshed = False
+        attempt = 0
+        while True:
+            self.stats["limiter_wait"] += await self.limiter.acquire()
+            request = build()
+            if request is None:
+                return None
+            self.stats["requests"] += 1
+            try:
+                if batch:
+                    result = await self.batcher.submit(request)
+                else:
+                    result = await run_in_worker(self.youtube.execute, request)
+            except google.auth.exceptions.RefreshError as e:
+                if refreshed:
+                    log.warning(f"Could not refresh the access token ({e})")
+                    return None
+                log.warning("Error with request")
+                try:
+                    await run_in_worker(self.youtube.auth.refresh)
+                except (google.auth.exceptions.RefreshError, *TRANSPORT_ERRORS) as e:
+                    log.warning(f"Could not refresh the access token ({e})")
+                    connectivity.probe_soon()
+                    return None
+                refreshed = True
+                continue
+            except Exception as e:
+                if not is_transient(e):
+                    self.breaker.success()  # the api answered, e.g. 304 Not Modified
+                    raise
+                if isinstance(e, TRANSPORT_ERRORS):
+                    connectivity.probe_soon()
+                if attempt >= self.maxRetries or self.breaker.is_open():
+                    self.stats["failures"] += 1
+                    if self.breaker.failure():
+                        self.stats["circuit_opened"] += 1
+                    if isinstance(e, googleapiclient.errors.HttpError):
+                        raise
+                    log.warning(f"Request failed ({e})")
+                    return None
+                attempt += 1
+                self.stats["retries"] += 1
+                delay = min(2**attempt * 0.5, 32) * random.uniform(0.5, 1)
+                log.info(f"Request failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.success()
+            return result
@@ -38,7 +38,7 @@ async def main(app, config):
     """Entry point of the program"""
     last_event = None
     while True:
-        char = app.scr.get_wch()
+        char = await app.scr.wait_key()
         if char == curses.KEY_RESIZE and last_event != curses.KEY_RESIZE:
             app.resize()
         else: